@@ -141,8 +141,10 @@ ln -snf ${PWD}/awscli/bin/aws bin/
 export PATH=$PATH:${PWD}/bin
 
 # Dependencies for running tests.  Need numpy, scipy and sklearn
-# for running toil-vg mapeval, and dateutils and reqests for ./mins_since_last_build.py
+# for running toil-vg mapeval, matplotlib for the mapeval plots, and dateutils
+# and reqests for ./mins_since_last_build.py
 pip install numpy
+pip install matplotlib
 pip install scipy==1.0.0rc2
 pip install sklearn
 pip install dateutils
@@ -171,6 +173,16 @@ git submodule update --init --recursive
 printf "cores ${NUM_CORES}\n" > vgci_cfg.tsv
 printf "teardown False\n" >> vgci_cfg.tsv
 printf "workdir ./vgci-work\n" >> vgci_cfg.tsv
+# keep downloaded test inputs between runs, on the big disk but outside TMPDIR,
+# which gets wiped. Set VGCI_CACHE_DIR to put them somewhere else.
+if [ -z "${VGCI_CACHE_DIR}" ] && [ -d "/mnt/ephemeral" ]
+then
+    VGCI_CACHE_DIR=/mnt/ephemeral/vgci-cache
+fi
+if [ ! -z "${VGCI_CACHE_DIR}" ]
+then
+    printf "cache_dir ${VGCI_CACHE_DIR}\n" >> vgci_cfg.tsv
+fi
 #printf "verify False\n" >> vgci_cfg.tsv
 #printf "baseline ./vgci-baseline\n" >> vgci_cfg.tsv
 
@@ -214,14 +226,16 @@ fi
 # For the actual test and the cleanup, continue on error
 set +e
 
-# run the tests, output the junit report for Jenkins
-pytest -vv "${PYTEST_TEST_SPEC}" --junitxml=test-report.xml ${SHOW_OPT}
+# run the tests, output the junit report for Jenkins.  tests are run
+# concurrently, sharing the cores from vgci_cfg.tsv
+jenkins/schedule-tests.py "${PYTEST_TEST_SPEC}" test-report.xml --pytest_opts "-vv ${SHOW_OPT}"
 PYRET="$?"
 
 # Generate a report in two files: HTML full output, and a Markdown summary.
 # Takes as input the Jenkins test result XML and the work directory with the
-# test output files.
-jenkins/mine-logs.py test-report.xml vgci-work/ report-html/ summary.md
+# test output files.  Each run is also added to a database of previous runs,
+# to chart and check runtimes against.
+jenkins/mine-logs.py test-report.xml vgci-work/ report-html/ summary.md --history_db vgci_history.db
 
 # Put the report on Github for the current pull request or commit.
 jenkins/post-report report-html summary.md
@@ -0,0 +1,152 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+"""
+Mapping evaluation plots (ROC, precision-recall and MAPQ QQ) for the VGCI
+report, made in-process from toil-vg mapeval position results.  These follow
+scripts/plot-roc.R, scripts/plot-pr.R and scripts/plot-qq.R, but work from
+arrays already in memory so one parse of position.results.tsv feeds every
+plot, and don't need an Rscript per plot.
+
+All the curves come from the correct and incorrect read counts at each
+distinct MAPQ, accumulated from the highest MAPQ down.
+"""
+from __future__ import unicode_literals, division
+import os
+import numpy as np
+import matplotlib
+# No display on the CI machines
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+
+# Same palette as the R scripts, so aligners keep their colors
+COLORS = ["#1f78b4","#a6cee3","#e31a1c","#fb9a99","#33a02c","#b2df8a","#6600cc","#e5ccff",
+          "#ff8000","#ffe5cc","#5c415d","#9a7c9b", "#458b74", "#76eec6", "#698b22", "#b3ee3a",
+          "#008b8b", "#00eeee"]
+
+# Inches, as in the ggsave calls of the R scripts
+FIG_SIZE = (5.45, 4)
+
+def mq_counts(correct, mq):
+    """ Get the distinct MAPQs in decreasing order, with the number of correct
+    (positive) and incorrect (negative) reads at each """
+    mqs, inverse = np.unique(mq, return_inverse=True)
+    positive = np.bincount(inverse, weights=(correct == 1), minlength=len(mqs))
+    negative = np.bincount(inverse, weights=(correct == 0), minlength=len(mqs))
+    return mqs[::-1], positive[::-1], negative[::-1]
+
+def roc_curve(correct, mq):
+    """ Get mqs, TPR, FPR and read counts for each MAPQ cutoff, where the rates
+    are over all reads so as to fold in each aligner's sensitivity """
+    mqs, positive, negative = mq_counts(correct, mq)
+    total = positive.sum() + negative.sum()
+    return mqs, np.cumsum(positive) / total, np.cumsum(negative) / total, positive + negative
+
+def pr_curve(correct, mq):
+    """ Get mqs, precision, recall and read counts for each MAPQ cutoff """
+    mqs, positive, negative = mq_counts(correct, mq)
+    tp = np.cumsum(positive)
+    fp = np.cumsum(negative)
+    fn = positive.sum() + negative.sum() - tp
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = tp / (tp + fp)
+        recall = tp / (tp + fn)
+    keep = np.isfinite(precision) & np.isfinite(recall)
+    return mqs[keep], precision[keep], recall[keep], (positive + negative)[keep]
+
+def qq_points(correct, mq):
+    """ Get the read count, mean MAPQ, predicted correct probability and
+    observed correct fraction for MAPQ bins (-Inf,0], (0,1], ..., (60,Inf) """
+    bins = np.searchsorted(np.arange(0, 61), mq, side='left')
+    counts = np.bincount(bins, minlength=62)
+    used = counts > 0
+    n = counts[used]
+    mapq = np.bincount(bins, weights=mq, minlength=62)[used] / n
+    observed = np.bincount(bins, weights=(correct == 1), minlength=62)[used] / n
+    mapprob = 1 - np.power(10, -mapq / 10)
+    return n, mapq, mapprob, observed
+
+def _aligner_groups(aligners, aligner_names=None):
+    """ Yield (aligner, color, row mask) for each aligner, in sorted order.
+    If aligner_names is given, aligners are codes into it (in name order) """
+    for i, aligner in enumerate(np.unique(aligners)):
+        name = aligner_names[aligner] if aligner_names is not None else aligner
+        yield name, COLORS[i % len(COLORS)], aligners == aligner
+
+def _point_sizes(counts, total):
+    """ Scale read counts to marker areas """
+    return 4 + 60 * np.sqrt(counts / max(total, 1))
+
+def _label_mqs(ax, mqs, x, y):
+    """ Label the points at every tenth MAPQ """
+    for mq, px, py in zip(mqs, x, y):
+        if mq % 10 == 0 and np.isfinite(px) and np.isfinite(py):
+            ax.annotate('{}'.format(int(mq)), (px, py), fontsize=7,
+                        xytext=(4, -8), textcoords='offset points')
+
+def _save(fig, ax, out_path):
+    ax.grid(True, color='#ebebeb')
+    ax.legend(loc='best', fontsize=6, frameon=False)
+    fig.tight_layout()
+    fig.savefig(out_path, format='svg')
+    plt.close(fig)
+
+def plot_roc(aligners, correct, mq, out_path, aligner_names=None):
+    """ Plot the pseudo-ROC (see scripts/plot-roc.R) to out_path """
+    fig, ax = plt.subplots(figsize=FIG_SIZE)
+    for aligner, color, rows in _aligner_groups(aligners, aligner_names):
+        mqs, tpr, fpr, counts = roc_curve(correct[rows], mq[rows])
+        ax.plot(fpr, tpr, color=color, label=aligner, linewidth=1)
+        ax.scatter(fpr, tpr, s=_point_sizes(counts, counts.sum()), color=color)
+        _label_mqs(ax, mqs, fpr, tpr)
+    # FPRs of 0 drop off the log axis, as they do in R
+    ax.set_xscale('log')
+    ax.set_xlabel('FPR')
+    ax.set_ylabel('TPR')
+    _save(fig, ax, out_path)
+
+def plot_pr(aligners, correct, mq, out_path, aligner_names=None):
+    """ Plot precision against recall on -log10 error axes (see
+    scripts/plot-pr.R) to out_path """
+    fig, ax = plt.subplots(figsize=FIG_SIZE)
+    for aligner, color, rows in _aligner_groups(aligners, aligner_names):
+        mqs, precision, recall, counts = pr_curve(correct[rows], mq[rows])
+        with np.errstate(divide='ignore'):
+            x = -np.log10(1 - recall)
+            y = -np.log10(1 - precision)
+        ax.plot(x, y, color=color, label=aligner, linewidth=1)
+        ax.scatter(x, y, s=_point_sizes(counts, counts.sum()), color=color)
+        _label_mqs(ax, mqs, x, y)
+    ticks = range(0, 8)
+    ax.set_xticks(ticks)
+    ax.set_xticklabels(['1e-{}'.format(t) for t in ticks])
+    ax.set_yticks(ticks)
+    ax.set_yticklabels(['1e-{}'.format(t) for t in ticks])
+    ax.set_xlim(0, 6)
+    ax.set_ylim(2, 6)
+    ax.set_xlabel('1 - Recall')
+    ax.set_ylabel('1 - Precision')
+    _save(fig, ax, out_path)
+
+def plot_qq(aligners, correct, mq, out_path, aligner_names=None):
+    """ Plot the measured error against the MAPQ error estimate (see
+    scripts/plot-qq.R) to out_path """
+    fig, ax = plt.subplots(figsize=FIG_SIZE)
+    for aligner, color, rows in _aligner_groups(aligners, aligner_names):
+        n, mapq, mapprob, observed = qq_points(correct[rows], mq[rows])
+        ax.scatter(1 - mapprob + 1e-9, 1 - observed + 1e-9, s=_point_sizes(n, n.sum()),
+                   color=color, label=aligner)
+    ax.plot([5e-7, 2], [5e-7, 2], linestyle='--', color='black', linewidth=1)
+    ax.set_xscale('log')
+    ax.set_yscale('log')
+    ax.set_xlim(5e-7, 2)
+    ax.set_ylim(5e-7, 2)
+    ax.set_xlabel('error estimate')
+    ax.set_ylabel('measured error')
+    _save(fig, ax, out_path)
+
+def write_plots(aligners, correct, mq, out_dir, suffix='', aligner_names=None):
+    """ Write pr{suffix}.svg, qq{suffix}.svg and roc{suffix}.svg to out_dir.
+    aligners are names, or codes into aligner_names if that's given """
+    for name, plot_fn in [('pr', plot_pr), ('qq', plot_qq), ('roc', plot_roc)]:
+        plot_fn(aligners, correct, mq, os.path.join(out_dir, '{}{}.svg'.format(name, suffix)),
+                aligner_names)
@@ -20,9 +20,14 @@ import shutil
 import datetime
 import cgi
 import io
+import gzip
+import json
+import multiprocessing
 import traceback
 from collections import defaultdict
 
+import perf_history
+
 
 
 def parse_args(args=None):
@@ -38,6 +43,12 @@ def parse_args(args=None):
                         help='output html directory')
     parser.add_argument('md_out',
                         help='output markdown')
+    parser.add_argument('--threads', type=int, default=None,
+                        help='processes to scrape logs and render the HTML report with '
+                        '(default: one per core)')
+    parser.add_argument('--history_db', default=None,
+                        help='SQLite database of previous runs to add this one to, '
+                        'and to chart trends and find runtime regressions with')
 
     args = args[1:]
         
@@ -53,50 +64,18 @@ def testname_to_outstore(test_name):
         toks[1], toks[2].replace('lrc-kir', 'lrc_kir').upper(), '-'.join(toks[3:]))
 
 
-def scrape_mapeval_runtimes(text):
-    """ toil-vg mapeval uses the RealtimeLogger to print the running times of 
-    each call to vg map (or vg mpmap).  We piece that information together
-    here 
-    
-    I would rather this be in vgci.py, but don't have access to the log there. 
-    So scrape it out here then add it to the table from vgci.py with join_runtimes below
+def iter_lines(text):
+    """ Iterate over the lines of a (possibly huge) string from the XML, with
+    their newlines, as unicode, without splitting the whole thing up at once """
+    if not text:
+        return
+    start = 0
+    while start < len(text):
+        end = text.find('\n', start)
+        end = len(text) if end < 0 else end + 1
+        yield unicode(text[start:end])
+        start = end
 
-    Todo: save the log into the workdir and mine from vgci.py
-    """
-    
-    runtimes = defaultdict(int)
-    for line in text.split('\n'):
-        # we want to parse something like
-        #host 2017-08-22 11:09:45,362 MainThread INFO toil-rt: Aligned /tmp/toil-55082/aligned-snp1kg_HG00096_0.gam. Process took 4.37375712395 seconds with single-end vg-map
-        search_tok = 'Aligned'
-        i = line.find(search_tok)
-        if i >= 0 and line.find('Process took') > 0:
-            try:
-                toks = line[i + len(search_tok) + 1: ].rstrip().split()
-                outputfile = toks[0]
-                seconds = round(float(toks[3]), 1)
-                read_type = toks[-2]
-                method = toks[-1]
-                # name will be something like tmpdir/aligned-primary_0.gam.
-                # so we cut down to just primary_0
-                name = os.path.basename(outputfile)[8:-5]
-                # then strip the _0
-                name = name[0:name.rfind('_')]
-                # and any tags for paired end
-                name = name.replace('-pe','').replace('-se','').replace('-mp','')
-                key = method if 'bwa' in method else name
-                if 'mpmap' in method:
-                    key += '-mp'
-                if 'single-end' in read_type:
-                    key += '-se'
-                elif 'paired-end' in read_type:
-                    key += '-pe'
-                runtimes[key] += seconds
-            except:
-                pass
-
-    return runtimes
-        
 def join_runtimes(mapeval_table, runtime_dict):
     """ Tack on some mapping runtimes that we mined above to the mapeval table that was printed 
     by the jenkins tests """
@@ -110,68 +89,89 @@ def join_runtimes(mapeval_table, runtime_dict):
 
     return mapeval_table
     
-def parse_begin_message(line):
-    """ Return True, name, is_tsv if tag found otherwise False, None, None """
-    try:
-        if 'VGCI' in line:
-            elem = ET.fromstring(line.encode('utf8').rstrip() + '</VGCI>')
-            if elem.tag == 'VGCI':
-                return True, elem.get('name'), elem.get('tsv', 'false').lower() == 'true'
-    except:
-        pass
-    return False, None, None
+# A line that is just <VGCI name = "..." tsv = "True"> (both attributes
+# optional) starts a message from vgci.py, and one that is just </VGCI> ends it
+VGCI_BEGIN_RE = re.compile(r'^<VGCI((?:\s+\w+\s*=\s*"[^"]*")*)\s*>$')
+VGCI_ATTR_RE = re.compile(r'(\w+)\s*=\s*"([^"]*)"')
+VGCI_END_RE = re.compile(r'^</VGCI>$')
+class LogScanner(object):
+    """
+    Scan a log one line at a time, pulling out all the things the report wants
+    in the same pass:
 
-def parse_end_message(line):
-    """ Return True if line marks end of a report """
-    try:
-        if 'VGCI' in line:
-            elem = ET.fromstring('<VGCI>' + line.encode('utf8').rstrip())
-            if elem.tag == 'VGCI':
-                return True
-    except:
-        pass
-    return False
+    messages: blocks and tables that vgci.py wrapped in VGCI tags.  A message
+    is a tuple of (name, table) or (name, text) where name can be None.  The
+    scanner is either outside a message, or in a text or table one.
 
-def scrape_messages(text):
-    """ Use the tags above to extract blocks and tables from a buffer.
-    A message is a tuple of (name, table) or (name, text) where name 
-    can be none """
+    warnings: CI warnings (vgci WARNING lines)
 
-    messages = []
-    msg = None
-    name = None
-    
-    for line in text.split('\n'):
-        is_msg, msg_name, is_tsv = parse_begin_message(line)
-        # start message
-        if is_msg:
-            if msg is not None:
-                messages.append((name, msg))
-                msg, name = None, None
-            name = msg_name            
-            if is_tsv:
-                msg = []
-            else:
-                msg = ''
-        # end message
-        elif parse_end_message(line):
-            if msg is not None:
-                messages.append((name, msg))
-                msg, name = None, None
+    runtimes: total mapeval map time for each key of the map eval results
+    table, if scan_runtimes is set.  I would rather this be in vgci.py, but
+    don't have access to the log there.  So scrape it out here then add it to
+    the table from vgci.py with join_runtimes below.  Todo: save the log into
+    the workdir and mine from vgci.py
+
+    Lines that can't be any of these are turned away with substring checks
+    before any regex gets run.
+    """
+    def __init__(self, scan_runtimes = False):
+        self.messages = []
+        self.msg = None
+        self.name = None
+        self.warnings = []
+        self.runtimes = defaultdict(int) if scan_runtimes else None
+
+    def _end_message(self):
+        if self.msg is not None:
+            self.messages.append((self.name, self.msg))
+            self.msg, self.name = None, None
+
+    def feed(self, line):
+        if 'VGCI' in line:
+            stripped = line.strip()
+            begin = VGCI_BEGIN_RE.match(stripped)
+            # start message
+            if begin:
+                self._end_message()
+                attrs = dict(VGCI_ATTR_RE.findall(begin.group(1)))
+                self.name = attrs.get('name')
+                self.msg = [] if attrs.get('tsv', 'false').lower() == 'true' else ''
+                return
+            # end message
+            if VGCI_END_RE.match(stripped):
+                self._end_message()
+                return
         # continue message
-        elif msg is not None:
-            if isinstance(msg, list):
+        if self.msg is not None:
+            if isinstance(self.msg, list):
                 row = line.rstrip().split('\t')
                 if len(row):
-                    msg.append(row)
+                    self.msg.append(row)
             else:
-                msg += line
-    if msg:
-        messages.append((name, msg))
-        msg, name = None, None
-
-    return messages
-    
+                self.msg += line
+            return
+        if 'vgci' in line and 'WARNING' in line:
+            # If it is a CI warning, keep it
+            self.warnings.append(line.rstrip())
+        if self.runtimes is not None and 'Process took' in line:
+            runtime = perf_history.parse_runtime(line)
+            if runtime is not None:
+                key, seconds = runtime
+                self.runtimes[key] += round(seconds, 1)
+
+    def finish(self):
+        """ Close off any message left open at the end of the log """
+        if self.msg:
+            self.messages.append((self.name, self.msg))
+        self.msg, self.name = None, None
+        return self
+
+def scan_text(text, scan_runtimes = False):
+    """ Run a LogScanner over a (possibly huge) string from the XML """
+    scanner = LogScanner(scan_runtimes)
+    for line in iter_lines(text):
+        scanner.feed(line)
+    return scanner.finish()
 
 def parse_testsuite_xml(testsuite):
     """
@@ -191,7 +191,8 @@ def parse_testsuite_xml(testsuite):
 def parse_testcase_xml(testcase):
     """
     Flatten fields of interest from a TestCase XML element into a dict,
-    where anything not found is None
+    where anything not found is None.  stdout and stderr are left to
+    scrape_testcase_logs
     """
     
     # We need to emit only Unicode things, but we may get str or Unicode
@@ -201,16 +202,6 @@ def parse_testcase_xml(testcase):
     tc['name'] = unicode(testcase.get('name'))
     tc['time'] = int(float(testcase.get('time', 0)))
 
-    if testcase.find('system-out') is not None:
-        tc['stdout'] = unicode(testcase.find('system-out').text)
-    else:
-        tc['stdout'] = None
-
-    if testcase.find('system-err') is not None:
-        tc['stderr'] = unicode(testcase.find('system-err').text)
-    else:
-        tc['stderr'] = None
-
     if testcase.find('skipped') is not None:
         tc['skipped'] = True
         tc['skip-msg'] = unicode(testcase.find('skipped').text)
@@ -230,22 +221,240 @@ def parse_testcase_xml(testcase):
 
     return tc
 
-def get_vgci_warnings(tc):
+# How many lines go in each compressed page of a log in the report
+LOG_PAGE_LINES = 20000
+
+# Page for browsing a paginated log.  Pages are fetched only when asked for,
+# and gunzipped in the browser.
+LOG_VIEWER_HTML = """<!DOCTYPE html><html><head>
+<meta charset="utf-8"/>
+<title>{title}</title>
+<style> body {{ font-family: sans-serif; }} pre {{ font-size: small; }} .pages a {{ margin-right: 0.5em; }} </style>
+</head><body>
+<h3>{title}</h3>
+<p>{lines} lines in {page_count} pages.  Page: <span class="pages" id="pages"></span></p>
+<pre id="log">Loading...</pre>
+<script>
+var index = {index};
+function gunzip(buffer) {{
+    var bytes = new Uint8Array(buffer);
+    if (bytes.length < 2 || bytes[0] != 0x1f || bytes[1] != 0x8b) {{
+        // the server already took the compression off
+        return Promise.resolve(new TextDecoder('utf-8').decode(bytes));
+    }}
+    var stream = new Blob([bytes]).stream().pipeThrough(new DecompressionStream('gzip'));
+    return new Response(stream).text();
+}}
+function pageOfLine(line) {{
+    for (var i = index.pages.length - 1; i > 0; i--) {{
+        if (index.pages[i].first_line <= line) {{ return i; }}
+    }}
+    return 0;
+}}
+function show() {{
+    var match = /(page|line)=(\\d+)/.exec(window.location.hash);
+    var page = 0;
+    if (match) {{
+        page = match[1] == 'page' ? parseInt(match[2]) : pageOfLine(parseInt(match[2]));
+    }}
+    page = Math.min(Math.max(page, 0), index.pages.length - 1);
+    var log = document.getElementById('log');
+    log.textContent = 'Loading page ' + page + '...';
+    fetch(index.pages[page].file)
+        .then(function(response) {{ return response.arrayBuffer(); }})
+        .then(gunzip)
+        .then(function(text) {{ log.textContent = text; }})
+        .catch(function(err) {{ log.textContent = 'Could not load ' + index.pages[page].file + ': ' + err; }});
+}}
+var links = document.getElementById('pages');
+index.pages.forEach(function(p, i) {{
+    var a = document.createElement('a');
+    a.href = '#page=' + i;
+    a.title = 'lines ' + p.first_line + '-' + (p.first_line + p.lines - 1);
+    a.textContent = i;
+    links.appendChild(a);
+}});
+window.addEventListener('hashchange', show);
+show();
+</script>
+</body></html>
+"""
+
+class PagedLogWriter(object):
     """
-    extract warnings from the parsed test case stderr
+    Write a log into a report directory as gzipped pages of page_lines lines
+    each (base-0.txt.gz, base-1.txt.gz, ...), an index of the first line,
+    line count and uncompressed size of each page (base-index.json), and a
+    base.html page to browse it with, which only downloads the page being
+    looked at.
     """
-    warnings = []
-    if tc['stderr']:
-        for line in tc['stderr'].split('\n'):
-            # For each line
-            if "WARNING" in line and "vgci" in line:
-                # If it is a CI warning, keep it
-                warnings.append(line.rstrip())
-    return warnings
-
-def md_summary(xml_root):
+    def __init__(self, report_dir, base_name, title, page_lines = LOG_PAGE_LINES):
+        self.report_dir = report_dir
+        self.base_name = base_name
+        self.title = title
+        self.page_lines = page_lines
+        self.pages = []
+        self.page_file = None
+        self.line_count = 0
+
+    def _end_page(self):
+        if self.page_file is not None:
+            self.page_file.close()
+            self.page_file = None
+
+    def write(self, line):
+        if self.page_file is None or self.pages[-1]['lines'] == self.page_lines:
+            self._end_page()
+            page_name = '{}-{}.txt.gz'.format(self.base_name, len(self.pages))
+            self.page_file = gzip.open(os.path.join(self.report_dir, page_name), 'wb')
+            self.pages.append({'file' : page_name, 'first_line' : self.line_count, 'lines' : 0, 'bytes' : 0})
+        data = line.encode('utf8')
+        self.page_file.write(data)
+        self.pages[-1]['lines'] += 1
+        self.pages[-1]['bytes'] += len(data)
+        self.line_count += 1
+
+    def close(self):
+        """ Finish the pages and write the index and viewer.  Returns the
+        name of the viewer page """
+        self._end_page()
+        index = {'lines' : self.line_count, 'pages' : self.pages}
+        with io.open(os.path.join(self.report_dir, '{}-index.json'.format(self.base_name)),
+                     'w', encoding='utf8') as index_file:
+            index_file.write(unicode(json.dumps(index)))
+        viewer_name = '{}.html'.format(self.base_name)
+        with io.open(os.path.join(self.report_dir, viewer_name), 'w', encoding='utf8') as viewer_file:
+            viewer_file.write(LOG_VIEWER_HTML.format(
+                title = escape(self.title), lines = self.line_count, page_count = len(self.pages),
+                index = json.dumps(index).replace('</', '<\\/')))
+        return viewer_name
+
+def read_results(results_path):
+    """ Load the tables a test wrote to vgci_results.jsonl (with _report_table
+    in vgci.py) as messages, like the ones LogScanner finds in stdout """
+    messages = []
+    with io.open(results_path, 'r', encoding='utf8') as results_file:
+        for line in results_file:
+            if line.strip():
+                record = json.loads(line)
+                if 'table' in record:
+                    messages.append((record.get('name'), record['table']))
+                else:
+                    messages.append((record.get('name'), record.get('text', '')))
+    return messages
+
+def scrape_testcase_logs(tc, stdout_text, stderr_path, work_dir, report_dir):
+    """
+    Make one pass over each of the stdout and stderr of a testcase with a
+    LogScanner, and store what it finds in the parsed testcase tc, where the
+    Markdown and HTML writers share it:
+      messages: tables from vgci_results.jsonl in the test's outstore, or
+                if there isn't one, VGCI tagged blocks and tables from stdout
+      runtimes: mapeval map times from stderr (for sim tests)
+      warnings: CI warnings from stderr
+      stderr: the name of the page in report_dir for browsing stderr, which
+              is copied there (compressed and paginated) as we go
+    stderr is read from the file at stderr_path, if any.
+    """
+    try:
+        results_path = os.path.join(work_dir, testname_to_outstore(tc['name']), 'vgci_results.jsonl')
+    except AssertionError:
+        results_path = None
+    if results_path and os.path.isfile(results_path):
+        tc['messages'] = read_results(results_path)
+    else:
+        tc['messages'] = scan_text(stdout_text).messages
+
+    tc['stderr'] = None
+    tc['warnings'] = []
+    tc['runtimes'] = None
+    if stderr_path is not None:
+        scanner = LogScanner(scan_runtimes = 'sim' in tc['name'])
+        err_log = PagedLogWriter(report_dir, '{}-stderr'.format(tc['name']), tc['name'])
+        # only break lines on \n, as iter_lines does
+        with io.open(stderr_path, 'r', encoding='utf8', newline='\n') as stderr_file:
+            for line in stderr_file:
+                scanner.feed(line)
+                err_log.write(line)
+        tc['stderr'] = err_log.close()
+        scanner.finish()
+        tc['warnings'] = scanner.warnings
+        tc['runtimes'] = scanner.runtimes
+
+def scrape_testcase(args):
+    """ Scrape the logs of a (tc, stdout text, stderr path, work_dir,
+    report_dir) testcase in a worker process, deleting the stderr file when
+    done.  Returns the scraped tc, or None if it couldn't be scraped """
+    tc, stdout_text, stderr_path, work_dir, report_dir = args
+    try:
+        scrape_testcase_logs(tc, stdout_text, stderr_path, work_dir, report_dir)
+        return tc
+    except Exception:
+        logging.warning('Unexpected error scraping testcase logs {}'.format(tc['name']))
+        print(traceback.format_exc())
+        return None
+    finally:
+        if stderr_path is not None:
+            os.remove(stderr_path)
+
+def mine_junit_xml(xml_in, work_dir, report_dir, threads = None):
     """
-    Make a brief summary in Markdown of a testsuite
+    Stream through the JUnit XML, returning the parsed testsuite and a list of
+    parsed and scraped testcases.  Only one testcase's XML (with its logs) is
+    in memory at a time: each one's stderr goes to a temporary file, and its
+    logs are scraped (and stderr paginated into report_dir) by a pool of
+    threads processes (default one per core).
+    """
+    ts = None
+    testcases = []
+    parse_errors = 0
+    pending = []
+    tmp_dir = tempfile.mkdtemp(prefix='mine-logs')
+    pool = multiprocessing.Pool(threads)
+    try:
+        # (cElementTree wants the event names as byte strings)
+        for event, elem in ET.iterparse(xml_in, events=(b'start', b'end')):
+            if event == 'start' and elem.tag == 'testsuite' and ts is None:
+                # will have to modify this if we ever add another test suite
+                ts = parse_testsuite_xml(elem)
+            elif event == 'end' and elem.tag == 'testcase':
+                try:
+                    tc = parse_testcase_xml(elem)
+                    stdout = elem.find('system-out')
+                    stderr = elem.find('system-err')
+                    stderr_path = None
+                    if stderr is not None and stderr.text:
+                        stderr_path = os.path.join(tmp_dir, '{}.stderr'.format(len(pending)))
+                        with io.open(stderr_path, 'w', encoding='utf8') as stderr_file:
+                            stderr_file.write(unicode(stderr.text))
+                    pending.append(pool.apply_async(scrape_testcase, [(
+                        tc, stdout.text if stdout is not None else None, stderr_path,
+                        work_dir, report_dir)]))
+                except Exception as err:
+                    logging.warning('Unexpected error parsing testcase XML {}'.format(elem.get('name')))
+                    print(traceback.format_exc())
+                    parse_errors += 1
+                # done with this one
+                elem.clear()
+        pool.close()
+        # keep the testcases in XML order
+        for result in pending:
+            tc = result.get()
+            if tc is None:
+                parse_errors += 1
+            else:
+                testcases.append(tc)
+    finally:
+        pool.terminate()
+        pool.join()
+        shutil.rmtree(tmp_dir)
+    if ts is not None:
+        ts['parse-errors'] = parse_errors
+    return ts, testcases
+
+def md_summary(ts, testcases):
+    """
+    Make a brief summary in Markdown of a parsed testsuite and its testcases
     """
     build_number = os.getenv('BUILD_NUMBER')
     if build_number:
@@ -260,11 +469,6 @@ def md_summary(xml_root):
             md += ' for merge to master'
         md += '.  View the [full report here]({{REPORT_URL}}).\n\n'
 
-        # will have to modify this if we ever add another test suite
-        testsuite = xml_root
-        
-        ts = parse_testsuite_xml(testsuite)
-
         md += '{} tests passed, {} tests failed and {} tests skipped in {} seconds\n\n'.format(
             ts['passes'], ts['fails'], ts['skips'], ts['time'])
 
@@ -273,20 +477,23 @@ def md_summary(xml_root):
 
         warnings = []
         
-        for testcase in testsuite.iter('testcase'):
-            try:
-                tc = parse_testcase_xml(testcase)
-                if tc['failed']:
-                    md += '* {} ({} seconds)\n'.format(tc['name'], tc['time'])
-                warnings += get_vgci_warnings(tc)
-            except:
-                md += '**Error parsing Test Case XML**\n'
+        for tc in testcases:
+            if tc['failed']:
+                md += '* {} ({} seconds)\n'.format(tc['name'], tc['time'])
+            warnings += tc['warnings']
+        md += '**Error parsing Test Case XML**\n' * ts['parse-errors']
             
         if len(warnings) > 0:
             if ts['fails'] is not None and int(ts['fails']) >= 1:
                 md += '\n'
             md += 'Tests produced {} warnings. {} were for lower-than-expected alignment scores\n\n'.format(
                 len(warnings), len([w for w in warnings if 'negative score' in w]))
+
+        if ts.get('regressions'):
+            md += 'Runtime regressions against recent merges to master:\n\n'
+            for test, series, value, mean, z in ts['regressions']:
+                md += '* {} {}: {} vs. {} on average\n'.format(test, series, round(value, 1), round(mean, 1))
+            md += '\n'
             
     except:
         md += ' **Error parsing Test Suite XML**\n'
@@ -300,9 +507,9 @@ def escape(string):
     """
     return cgi.escape(string, quote=True)
         
-def html_header(xml_root):
+def html_header(ts):
     """
-    Make an HTML header for the test suite XML
+    Make an HTML header for the parsed test suite
     """
     
     report = ''
@@ -322,11 +529,6 @@ h1, h2, h3, h4, h5, h6 { font-family: sans-serif; }
 </style></head><body>
 '''
 
-        # will have to modify this if we ever add another test suite
-        testsuite = xml_root
-        
-        ts = parse_testsuite_xml(testsuite)
-
         build_number = os.getenv('BUILD_NUMBER')
 
         report += '<h2>vg Test Report'
@@ -364,43 +566,80 @@ def html_table(table, caption = None):
     """
     take a table (list of lists) as scraped above and write a HTML table.
     """
-    t = '<table>\n'
+    t = ['<table>\n']
     if caption:
-        t += '<caption align="bottom"><i>{}</i></caption>\n'.format(caption)                
+        t.append('<caption align="bottom"><i>{}</i></caption>\n'.format(caption))
     for i, row in enumerate(table):
-        t += '<tr>\n'
+        t.append('<tr>\n')
         tag = 'th' if i == 0 else 'td'
         for col in row:
-            t += '<{}>{}</{}>\n'.format(tag, col, tag)
-    t += '</table>\n'
-    return t
+            t.append('<{}>{}</{}>\n'.format(tag, col, tag))
+    t.append('</table>\n')
+    return ''.join(t)
 
-def html_testcase(tc, work_dir, report_dir, max_warnings = 10):
+def html_sparkline(values, flagged = False, width = 120, height = 24):
+    """
+    Draw a series as a little inline SVG line, with its last point marked
+    (in red if flagged)
+    """
+    if len(values) == 0:
+        return ''
+    low, high = min(values), max(values)
+    span = float(high - low) or 1.
+    step = float(width) / max(len(values) - 1, 1)
+    points = [(i * step, height - 2 - (v - low) / span * (height - 4)) for i, v in enumerate(values)]
+    svg = '<svg width="{}" height="{}">'.format(width + 4, height)
+    svg += '<polyline fill="none" stroke="#1f78b4" points="{}"/>'.format(
+        ' '.join('{:.1f},{:.1f}'.format(x + 2, y) for x, y in points))
+    svg += '<circle cx="{:.1f}" cy="{:.1f}" r="2.5" fill="{}"/>'.format(
+        points[-1][0] + 2, points[-1][1], '#e31a1c' if flagged else '#1f78b4')
+    svg += '</svg>'
+    return svg
+
+def html_trends(trends):
+    """
+    take the (series name, history, value, regression) list from
+    perf_history for a test case and make a HTML table of them
     """
-    Make an HTML report for a single test case
+    table = [['', 'Trend', 'This Run', 'Recent Mean', 'Change']]
+    for name, history, value, z in trends:
+        if len(history) > 0:
+            mean = perf_history.mean_sd(history)[0]
+            change = '{:+.1f}%'.format(100. * (value - mean) / mean) if mean else 'N/A'
+        else:
+            mean, change = 'N/A', 'N/A'
+        if z is not None:
+            change = '<font color="FF0000">{} (regression)</font>'.format(change)
+        table.append([escape(name), html_sparkline(history + [value], z is not None),
+                      round(value, 4), mean if mean == 'N/A' else round(mean, 4), change])
+    return html_table(table, 'trends vs. recent merges to master')
+
+def html_testcase(out, tc, work_dir, report_dir, max_warnings = 10):
+    """
+    Write an HTML report for a single test case to the file-like out
     """
-    report = '\n<hr>\n'
+    out.write('\n<hr>\n')
     try:
         if tc['failed']:
-            report += '<h3><font color="FF0000">{}</font></h3>\n'.format(tc['name'])
+            out.write('<h3><font color="FF0000">{}</font></h3>\n'.format(tc['name']))
         else:
-            report += '<h3>{}</h3>\n'.format(tc['name'])            
+            out.write('<h3>{}</h3>\n'.format(tc['name']))
         if tc['failed']:
-            report += '<p><b><font color="FF0000">Failed</font></b> in {} seconds</p>\n'.format(tc['time'])
-            report += '<p>Failure Text</p>\n<pre>'
+            out.write('<p><b><font color="FF0000">Failed</font></b> in {} seconds</p>\n'.format(tc['time']))
+            out.write('<p>Failure Text</p>\n<pre>')
             for line in tc['fail-txt'].split('\n'):
                 for subline in textwrap.wrap(line, 80):
-                    report += escape(subline) + '\n'
-            report += '</pre>\n'
+                    out.write(escape(subline) + '\n')
+            out.write('</pre>\n')
 
-            report += '<p>Failure Message</p>\n<pre>'
+            out.write('<p>Failure Message</p>\n<pre>')
             for line in tc['fail-msg'].split('\n'):
                 for subline in textwrap.wrap(line, 80):
-                    report += escape(subline) + '\n'
-            report += '</pre>\n'
+                    out.write(escape(subline) + '\n')
+            out.write('</pre>\n')
 
         else:
-            report += '<p>Passed in {} seconds</p>\n'.format(tc['time'])
+            out.write('<p>Passed in {} seconds</p>\n'.format(tc['time']))
 
         outstore = os.path.join(work_dir, testname_to_outstore(tc['name']))
 
@@ -420,59 +659,59 @@ def html_testcase(tc, work_dir, report_dir, max_warnings = 10):
                     os.path.basename(plot_path)))
 
         if len(images) > 0:
-            report += '<table class="image">\n'
+            out.write('<table class="image">\n')
             i = 0
             row_size = 2
             while i < len(images):
-                report += '<tr>'
+                out.write('<tr>')
                 for j in range(i, i + row_size):
                     if j < len(images):
-                        report += '<td><img width=\"300px\" src=\"{}\"></td>'.format(images[j])
-                report += '</tr>\n<tr>'
+                        out.write('<td><img width=\"300px\" src=\"{}\"></td>'.format(images[j]))
+                out.write('</tr>\n<tr>')
                 for j in range(i, i + row_size):
                     if j < len(images):
-                        report += '<td><a href=\"{}\">{} Plot</a>'.format(images[j], captions[j])
-                        report += ' <a href=\"{}\">(baseline)</a></td>'.format(baseline_images[j])
-                report += '</tr>\n'
+                        out.write('<td><a href=\"{}\">{} Plot</a>'.format(images[j], captions[j]))
+                        out.write(' <a href=\"{}\">(baseline)</a></td>'.format(baseline_images[j]))
+                out.write('</tr>\n')
                 i += row_size
-            report += '</table>\n'
+            out.write('</table>\n')
 
-        # extract running times from stderr (only for mapeval)
-        map_time_table = None
-        if tc['stderr'] and 'sim' in tc['name']:
-            map_time_table = scrape_mapeval_runtimes(tc['stderr'])
+        # running times scraped from stderr (only for mapeval)
+        map_time_table = tc['runtimes']
             
-        if tc['stdout']:
-            # extract only things in <VCGI> tags from stdout
-            messages = scrape_messages(tc['stdout'])
-            for message in messages:                
+        if tc['messages']:
+            # only things in <VCGI> tags from stdout
+            for message in tc['messages']:                
                 name, body = message[0], message[1]                    
                 if isinstance(body, list):
                     if name and name.startswith('map eval results') and map_time_table:
                         body = join_runtimes(body, map_time_table)
-                    report += html_table(body, name)
+                    out.write(html_table(body, name))
                 else:
                     if name:
-                        report += '<h5>{}</h5>\n'.format(name)                    
-                    report += '<pre>'
+                        out.write('<h5>{}</h5>\n'.format(name))
+                    out.write('<pre>')
                     for line in body.split('\n'):
                         for subline in textwrap.wrap(line, 80):
-                            report += escape(subline) + '\n'
-                    report += '</pre>\n'
+                            out.write(escape(subline) + '\n')
+                    out.write('</pre>\n')
+
+        if tc.get('trends'):
+            out.write(html_trends(tc['trends']))
 
         if tc['stderr']:
-            # Look for warning lines in stderr
-            warnings = get_vgci_warnings(tc)
+            # warning lines in stderr
+            warnings = tc['warnings']
 
             # report top warnings in HTML
             if len(warnings) > 0:
-                report += '<p>{} CI warnings found'.format(len(warnings))
+                out.write('<p>{} CI warnings found'.format(len(warnings)))
                 if len(warnings) > max_warnings:
-                    report += '; showing first {}'.format(max_warnings)
-                report += ':'
-                report += '</p>\n'
+                    out.write('; showing first {}'.format(max_warnings))
+                out.write(':')
+                out.write('</p>\n')
                 for warning in warnings[:max_warnings]:            
-                    report += '<pre>{}</pre>\n'.format(escape('\n'.join(textwrap.wrap(warning, 80))))
+                    out.write('<pre>{}</pre>\n'.format(escape('\n'.join(textwrap.wrap(warning, 80)))))
 
                 # warnings file
                 if len(warnings) > max_warnings:
@@ -482,51 +721,61 @@ def html_testcase(tc, work_dir, report_dir, max_warnings = 10):
                             warn_file.write(warning + '\n')
 
             # entire stderr output (which also includes warnings, should we filter?)
-            err_name = '{}-stderr.txt'.format(tc['name'])
-            with io.open(os.path.join(report_dir, err_name), 'w', encoding='utf8') as err_file:
-                err_file.write(tc['stderr'])
+            # was already copied to the report directory, in compressed pages
+            # with a page to view them, when scraped
+            err_name = tc['stderr']
 
             # link to warnings and stderr
-            report += '<p>'
+            out.write('<p>')
             if len(warnings) > max_warnings:
-                report += '<a href={}>All CI Warnings</a>, '.format(warn_name)
-            report += '<a href={}>Standard Error</a></p>\n'.format(err_name)
+                out.write('<a href={}>All CI Warnings</a>, '.format(warn_name))
+            out.write('<a href={}>Standard Error</a></p>\n'.format(err_name))
 
     except int as e:
-        report += 'Error parsing Test Case XML\n'
+        out.write('Error parsing Test Case XML\n')
 
-    return report
 
-def write_html_report(xml_root, work_dir, html_dir, html_name = 'index.html'):
-    """ Write the HTML report in a given directory
+def render_testcase(args):
+    """ Render the HTML report for a (tc, work_dir, report_dir) test case in a
+    worker process, returning it as a string """
+    tc, work_dir, report_dir = args
+    out = io.StringIO()
+    try:
+        html_testcase(out, tc, work_dir, report_dir)
+    except:
+        # tracebacks don't make it back from the pool in one piece
+        logging.warning('Unexpected error writing report for {}'.format(tc['name']))
+        print(traceback.format_exc())
+        raise
+    return out.getvalue()
+
+def write_html_report(ts, testcases, work_dir, html_dir, html_name = 'index.html', threads = None):
+    """ Write the HTML report in a given directory.  The test case sections
+    are rendered by a pool of threads processes (default one per core),
+    and written out in order as they come back
     """
     if not os.path.isdir(html_dir):
         os.makedirs(html_dir)
         
     html_path = os.path.join(html_dir, html_name)
     with io.open(html_path, 'w', encoding='utf8') as html_file:
-        header = html_header(xml_root)
+        header = html_header(ts)
         html_file.write(header)
         
-        parsed_testcases = []
-        for testcase in xml_root.iter('testcase'):
-            try:
-                tc = parse_testcase_xml(testcase)
-                parsed_testcases.append(tc)
-            except Exception as err:
-                logging.warning('Unexpected error parsing testcase XML {}'.format(testcase))
-                print(traceback.format_exc())
-
         # sort test cases so failed first, then sim, the by name
         def sort_key(tc):
             key = ('0' if 'sim' in tc['name'] else '1') 
             key = ('0' if tc['failed'] else '1') + key
             return key + tc['name']
                 
-        for tc in sorted(parsed_testcases, key=sort_key):
-            if not tc['skipped']:
-                tc_body = html_testcase(tc, work_dir, html_dir)
+        jobs = [(tc, work_dir, html_dir) for tc in sorted(testcases, key=sort_key) if not tc['skipped']]
+        pool = multiprocessing.Pool(threads)
+        try:
+            for tc_body in pool.imap(render_testcase, jobs):
                 html_file.write(tc_body)
+        finally:
+            pool.close()
+            pool.join()
             
         html_file.write('</body>\n</html>\n')
         
@@ -537,17 +786,35 @@ def main(args):
     """    
     options = parse_args(args)
 
-    # Load up the XML
-    xml_tree = ET.parse(options.xml_in)
-    xml_root = xml_tree.getroot()
+    if not os.path.isdir(options.html_out_dir):
+        os.makedirs(options.html_out_dir)
+
+    # Stream through the XML, scraping each testcase as we go (and copying
+    # its stderr into the HTML report directory)
+    ts, testcases = mine_junit_xml(options.xml_in, options.work_dir, options.html_out_dir,
+                                   threads = options.threads)
+
+    if options.history_db:
+        # Add this run to the history, and compare it to recent merges to master
+        history = perf_history.PerfHistory(options.history_db)
+        run_id = history.record_run(
+            testcases, build = os.getenv('BUILD_NUMBER'), pr = os.getenv('ghprbPullId'),
+            git_commit = os.getenv('ghprbActualCommit', os.getenv('GIT_COMMIT')),
+            master = bool(os.getenv('BUILD_NUMBER')) and not os.getenv('ghprbPullId'))
+        trends = history.trends(run_id)
+        for tc in testcases:
+            tc['trends'] = trends.get(tc['name'])
+        ts['regressions'] = history.regressions(run_id)
+        history.close()
     
     # Write our Markdown summary
-    markdown = md_summary(xml_root)
+    markdown = md_summary(ts, testcases)
     with io.open(options.md_out, 'w', encoding='utf8') as md_file:
         md_file.write(markdown)
 
     # Write our HTML report
-    write_html_report(xml_root, options.work_dir, options.html_out_dir)
+    write_html_report(ts, testcases, options.work_dir, options.html_out_dir,
+                      threads = options.threads)
     
 if __name__ == "__main__" :
     sys.exit(main(sys.argv))
@@ -0,0 +1,225 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+"""
+Historical record of VGCI runs, kept in a SQLite database so the report can
+show how test wall times, mapping times and accuracy stats have moved over
+time, instead of only comparing against the one baseline snapshot.
+
+Runtime regressions are flagged by comparing a run's times against the
+recent history of merges to master: a time is flagged when it is more than
+REGRESSION_Z standard deviations above the historical mean, and also at least
+REGRESSION_MIN_CHANGE slower, so tiny noisy tests don't trip it.
+
+The mapeval map times are parsed out of toil-vg's log lines here, for both
+mine-logs.py (from the test logs) and vgci.py (as they are logged).
+"""
+from __future__ import unicode_literals, division
+import sqlite3
+import datetime
+import math
+import os
+import re
+
+# How many previous master runs to compare against
+HISTORY_RUNS = 20
+# Don't test for regressions with fewer previous runs than this
+MIN_HISTORY_RUNS = 5
+# How many standard deviations above the mean is a regression
+REGRESSION_Z = 3.0
+# And by what fraction of the mean it must be slower
+REGRESSION_MIN_CHANGE = 0.1
+
+# toil-vg mapeval uses the RealtimeLogger to print the running times of each
+# call to vg map (or vg mpmap), like
+#host 2017-08-22 11:09:45,362 MainThread INFO toil-rt: Aligned /tmp/toil-55082/aligned-snp1kg_HG00096_0.gam. Process took 4.37375712395 seconds with single-end vg-map
+RUNTIME_RE = re.compile(r'Aligned\s+(\S+)\s+Process took\s+(\S+)\s.*\s(\S+)\s+(\S+)\s*$')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    time TEXT,
+    build TEXT,
+    pr TEXT,
+    git_commit TEXT,
+    master INTEGER);
+CREATE TABLE IF NOT EXISTS test_times (
+    run_id INTEGER, test TEXT, seconds REAL, failed INTEGER);
+CREATE TABLE IF NOT EXISTS map_times (
+    run_id INTEGER, test TEXT, method TEXT, seconds REAL);
+CREATE TABLE IF NOT EXISTS stats (
+    run_id INTEGER, test TEXT, table_name TEXT, method TEXT, stat TEXT, value REAL);
+CREATE INDEX IF NOT EXISTS test_times_test ON test_times (test);
+CREATE INDEX IF NOT EXISTS map_times_test ON map_times (test, method);
+CREATE INDEX IF NOT EXISTS stats_test ON stats (test, method, stat);
+"""
+
+def runtime_key(outputfile, read_type, method):
+    """ Get the mapeval table key (ex primary-se) for a mapeval runtime log line """
+    # name will be something like tmpdir/aligned-primary_0.gam.
+    # so we cut down to just primary_0
+    name = os.path.basename(outputfile)[8:-5]
+    # then strip the _0
+    name = name[0:name.rfind('_')]
+    # and any tags for paired end
+    name = name.replace('-pe','').replace('-se','').replace('-mp','')
+    key = method if 'bwa' in method else name
+    if 'mpmap' in method:
+        key += '-mp'
+    if 'single-end' in read_type:
+        key += '-se'
+    elif 'paired-end' in read_type:
+        key += '-pe'
+    return key
+
+def parse_runtime(line):
+    """ Get the (mapeval table key, seconds) of a mapeval runtime log line,
+    or None if it isn't one """
+    match = RUNTIME_RE.search(line)
+    if not match:
+        return None
+    outputfile, seconds, read_type, method = match.groups()
+    try:
+        return runtime_key(outputfile, read_type, method), float(seconds)
+    except ValueError:
+        return None
+
+def cell_value(cell):
+    """ Get the number out of a report table cell like 0.95 or ↓ 0.95, or None """
+    toks = unicode(cell).split()
+    if len(toks) == 0:
+        return None
+    try:
+        value = float(toks[-1])
+    except ValueError:
+        return None
+    return value if not math.isnan(value) else None
+
+def table_stats(table):
+    """ Yield (method, stat, value) for the numeric cells of a report table
+    (list of rows, with a header row), skipping the baseline columns that we
+    already keep the history of """
+    if len(table) < 2:
+        return
+    header = table[0]
+    for row in table[1:]:
+        if len(row) == 0:
+            continue
+        method = row[0].rstrip('*')
+        for stat, cell in zip(header[1:], row[1:]):
+            if stat.startswith('Baseline') or stat == 'Test Threshold':
+                continue
+            value = cell_value(cell)
+            if value is not None:
+                yield method, stat, value
+
+def mean_sd(values):
+    """ Get the mean and sample standard deviation of a list of numbers """
+    mean = sum(values) / len(values)
+    if len(values) < 2:
+        return mean, 0.
+    var = sum((v - mean) ** 2 for v in values) / (len(values) - 1)
+    return mean, math.sqrt(var)
+
+class PerfHistory(object):
+    """
+    The database of CI runs.  Each run gets the wall time of each test, the
+    mapeval map time of each method, and the numbers from the tables the
+    tests printed (vcfeval and map eval results)
+    """
+    def __init__(self, db_path):
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def record_run(self, testcases, build=None, pr=None, git_commit=None, master=False):
+        """ Add a run, given the parsed and scraped testcases from mine-logs.py.
+        Returns the new run's ID """
+        with self.db:
+            cursor = self.db.execute(
+                'INSERT INTO runs (time, build, pr, git_commit, master) VALUES (?, ?, ?, ?, ?)',
+                (datetime.datetime.now().isoformat(), build, pr, git_commit, int(master)))
+            run_id = cursor.lastrowid
+            for tc in testcases:
+                if tc['skipped']:
+                    continue
+                self.db.execute('INSERT INTO test_times VALUES (?, ?, ?, ?)',
+                                (run_id, tc['name'], tc['time'], int(tc['failed'])))
+                for method, seconds in (tc['runtimes'] or {}).items():
+                    self.db.execute('INSERT INTO map_times VALUES (?, ?, ?, ?)',
+                                    (run_id, tc['name'], method, seconds))
+                for name, body in tc['messages']:
+                    if isinstance(body, list):
+                        self.db.executemany('INSERT INTO stats VALUES (?, ?, ?, ?, ?, ?)',
+                                            [(run_id, tc['name'], name, method, stat, value)
+                                             for method, stat, value in table_stats(body)])
+        return run_id
+
+    def _history(self, query, args, run_id, limit=HISTORY_RUNS):
+        """ Get the values of the given series from the latest master runs
+        before run_id, oldest first """
+        rows = self.db.execute(query + ' AND runs.master = 1 AND runs.run_id < ? '
+                               'ORDER BY runs.run_id DESC LIMIT ?',
+                               args + (run_id, limit)).fetchall()
+        return [row[0] for row in reversed(rows)]
+
+    def test_time_history(self, test, run_id, limit=HISTORY_RUNS):
+        return self._history('SELECT seconds FROM test_times JOIN runs USING (run_id) '
+                             'WHERE test = ? AND failed = 0', (test,), run_id, limit)
+
+    def map_time_history(self, test, method, run_id, limit=HISTORY_RUNS):
+        return self._history('SELECT seconds FROM map_times JOIN runs USING (run_id) '
+                             'WHERE test = ? AND method = ?', (test, method), run_id, limit)
+
+    def stat_history(self, test, method, stat, run_id, limit=HISTORY_RUNS):
+        return self._history('SELECT value FROM stats JOIN runs USING (run_id) '
+                             'WHERE test = ? AND method = ? AND stat = ?',
+                             (test, method, stat), run_id, limit)
+
+    def trends(self, run_id):
+        """ Get a dict of test name to a list of (series name, history,
+        current value, regression) for the test times, map times and stats of
+        a run, where regression is None or the z-score of a flagged slowdown
+        (only runtimes are checked) """
+        trends = dict()
+        for test, seconds, failed in self.db.execute(
+                'SELECT test, seconds, failed FROM test_times WHERE run_id = ? ORDER BY test', (run_id,)).fetchall():
+            history = self.test_time_history(test, run_id)
+            trends[test] = [('Wall Time (s)', history, seconds,
+                             None if failed else regression(history, seconds))]
+        for test, method, seconds in self.db.execute(
+                'SELECT test, method, seconds FROM map_times WHERE run_id = ? ORDER BY test, method',
+                (run_id,)).fetchall():
+            history = self.map_time_history(test, method, run_id)
+            trends.setdefault(test, []).append(('{} Map Time (s)'.format(method), history, seconds,
+                                                regression(history, seconds)))
+        for test, method, stat, value in self.db.execute(
+                'SELECT test, method, stat, value FROM stats WHERE run_id = ? ORDER BY test, method, stat',
+                (run_id,)).fetchall():
+            history = self.stat_history(test, method, stat, run_id)
+            trends.setdefault(test, []).append(('{} {}'.format(method, stat), history, value, None))
+        return trends
+
+    def regressions(self, run_id):
+        """ Get (test, series name, current value, historical mean, z-score) for
+        each flagged runtime regression in a run """
+        flagged = []
+        for test, series in sorted(self.trends(run_id).items()):
+            for name, history, value, z in series:
+                if z is not None:
+                    flagged.append((test, name, value, mean_sd(history)[0], z))
+        return flagged
+
+def regression(history, value):
+    """ Get the z-score of value against history if it's a significant
+    slowdown, otherwise None """
+    if len(history) < MIN_HISTORY_RUNS:
+        return None
+    mean, sd = mean_sd(history)
+    if value < mean * (1 + REGRESSION_MIN_CHANGE):
+        return None
+    # don't let a perfectly steady history make any blip significant
+    sd = max(sd, mean * 0.01, 1e-9)
+    z = (value - mean) / sd
+    return z if z > REGRESSION_Z else None
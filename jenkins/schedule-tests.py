@@ -0,0 +1,220 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+"""
+Run the VGCI tests concurrently, each in its own PyTest process with a slice
+of the total core budget (the cores setting in vgci_cfg.tsv).  Tests are
+started longest-first, using their durations from previous runs when we have
+them and their timeouts when we don't, so the wall time of the suite
+approaches that of its longest test rather than the sum of all of them.
+
+The per-test JUnit reports are merged into one for mine-logs.py.
+"""
+from __future__ import unicode_literals
+import argparse
+import io
+import os
+import re
+import subprocess
+import sys
+import time
+import xml.etree.cElementTree as ET
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('test_spec',
+                        help='PyTest test specifier, ex jenkins/vgci.py')
+    parser.add_argument('xml_out',
+                        help='merged JUnit XML report to write')
+    parser.add_argument('--cores', type=int, default=None,
+                        help='total core budget (default: cores from vgci_cfg.tsv, or 8)')
+    parser.add_argument('--test_cores', type=int, default=8,
+                        help='cores given to each test')
+    parser.add_argument('--durations', default='vgci_durations.tsv',
+                        help='TSV of test name and seconds taken, read for scheduling '
+                        'and updated with this run')
+    parser.add_argument('--parts_dir', default='vgci-parts',
+                        help='directory for per-test JUnit reports and logs')
+    parser.add_argument('--pytest_opts', default='-vv',
+                        help='options to pass to each pytest. wrap in ""')
+
+    args = args[1:]
+
+    return parser.parse_args(args)
+
+def cfg_cores(cfg_path = 'vgci_cfg.tsv'):
+    """ get the cores setting from the vgci config file, if any """
+    if os.path.isfile(cfg_path):
+        with io.open(cfg_path, 'r', encoding='utf8') as f:
+            for line in f:
+                toks = line.split()
+                if len(toks) == 2 and toks[0] == 'cores':
+                    return int(toks[1])
+    return None
+
+def collect_tests(test_spec):
+    """ get the PyTest node IDs of all the tests in the spec """
+    output = subprocess.check_output(['pytest', '--collect-only', '-q', test_spec])
+    return [line.strip() for line in output.decode('utf8').split('\n') if '::' in line]
+
+def test_name(test_id):
+    """ get test_sim_foo out of jenkins/vgci.py::VGCITest::test_sim_foo """
+    return test_id.split('::')[-1]
+
+def read_timeouts(test_ids):
+    """ scrape the timeout_decorator timeout of each test out of its source """
+    timeouts = dict()
+    for source_path in set(t.split('::')[0] for t in test_ids):
+        with io.open(source_path, 'r', encoding='utf8') as source_file:
+            timeout = None
+            for line in source_file:
+                match = re.match(r'\s*@timeout_decorator\.timeout\((\d+)\)', line)
+                if match:
+                    timeout = int(match.group(1))
+                match = re.match(r'\s*def (test_\w+)\(', line)
+                if match:
+                    if timeout is not None:
+                        timeouts[match.group(1)] = timeout
+                    timeout = None
+    return timeouts
+
+def read_durations(durations_path):
+    """ load a dict of test name to seconds taken in previous runs """
+    durations = dict()
+    if os.path.isfile(durations_path):
+        with io.open(durations_path, 'r', encoding='utf8') as durations_file:
+            for line in durations_file:
+                toks = line.split()
+                if len(toks) == 2 and toks[0][0] != '#':
+                    durations[toks[0]] = float(toks[1])
+    return durations
+
+def write_durations(durations_path, durations):
+    """ save a dict of test name to seconds taken """
+    with io.open(durations_path, 'w', encoding='utf8') as durations_file:
+        for name in sorted(durations.keys()):
+            durations_file.write('{}\t{}\n'.format(name, round(durations[name], 1)))
+
+def run_tests(test_ids, estimates, cores, test_cores, parts_dir, pytest_opts):
+    """
+    Run the tests, longest estimate first, with as many at once as fit in the
+    core budget.  Returns a dict of test ID to (exit status, seconds taken)
+    """
+    pending = sorted(test_ids, key = lambda t: -estimates.get(test_name(t), 0))
+    test_cores = max(1, min(test_cores, cores))
+    free_cores = cores
+    running = dict()
+    results = dict()
+
+    while len(pending) > 0 or len(running) > 0:
+        # start everything that fits
+        while len(pending) > 0 and free_cores >= test_cores:
+            test_id = pending.pop(0)
+            name = test_name(test_id)
+            cmd = ['pytest'] + pytest_opts.split() + [
+                test_id, '--junitxml={}'.format(os.path.join(parts_dir, name + '.xml'))]
+            # vgci.py picks its core count up from here
+            env = dict(os.environ)
+            env['VGCI_CORES'] = str(test_cores)
+            print('Starting {} with {} cores (estimated {}s)'.format(
+                name, test_cores, int(estimates.get(name, 0))))
+            sys.stdout.flush()
+            with open(os.path.join(parts_dir, name + '.log'), 'w') as log_file:
+                proc = subprocess.Popen(cmd, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+            # keep the Popen, so subprocess doesn't reap it behind our back
+            running[proc] = (test_id, time.time())
+            free_cores -= test_cores
+
+        # wait for something to finish
+        finished = [proc for proc in running if proc.poll() is not None]
+        if len(finished) == 0:
+            time.sleep(1)
+            continue
+        for proc in finished:
+            test_id, start_time = running.pop(proc)
+            elapsed = time.time() - start_time
+            # negative return codes are deaths by signal
+            results[test_id] = (proc.returncode if proc.returncode >= 0 else -1, elapsed)
+            free_cores += test_cores
+            print('Finished {} with status {} in {}s'.format(
+                test_name(test_id), results[test_id][0], int(elapsed)))
+            sys.stdout.flush()
+
+    return results
+
+def merge_junit(test_ids, results, parts_dir, wall_time):
+    """
+    Merge the per-test JUnit reports into one testsuite element.  Tests
+    whose PyTest didn't leave a report get a failed testcase.
+    """
+    counts = {'tests' : 0, 'failures' : 0, 'errors' : 0, 'skips' : 0}
+    suite = ET.Element('testsuite')
+    for test_id in test_ids:
+        name = test_name(test_id)
+        xml_path = os.path.join(parts_dir, name + '.xml')
+        if os.path.isfile(xml_path):
+            part_root = ET.parse(xml_path).getroot()
+            part_suites = [part_root] if part_root.tag == 'testsuite' else part_root.findall('testsuite')
+            for part_suite in part_suites:
+                counts['tests'] += int(part_suite.get('tests', 0))
+                counts['failures'] += int(part_suite.get('failures', 0))
+                counts['errors'] += int(part_suite.get('errors', 0))
+                counts['skips'] += int(part_suite.get('skips', part_suite.get('skipped', 0)))
+                for testcase in part_suite.iter('testcase'):
+                    suite.append(testcase)
+        else:
+            status, elapsed = results.get(test_id, (-1, 0))
+            testcase = ET.SubElement(suite, 'testcase', name=name, time=str(elapsed))
+            failure = ET.SubElement(testcase, 'failure',
+                                    message='pytest exited with status {} without a report'.format(status))
+            log_path = os.path.join(parts_dir, name + '.log')
+            if os.path.isfile(log_path):
+                with io.open(log_path, 'r', encoding='utf8', errors='replace') as log_file:
+                    failure.text = log_file.read()[-10000:]
+            counts['tests'] += 1
+            counts['failures'] += 1
+
+    suite.set('name', 'pytest')
+    for key, val in counts.items():
+        suite.set(key, str(val))
+    suite.set('time', str(wall_time))
+    return ET.ElementTree(suite), counts
+
+def main(args):
+    """
+    Schedule the tests, run them, and merge their reports
+    """
+    options = parse_args(args)
+
+    cores = options.cores or cfg_cores() or 8
+
+    if not os.path.isdir(options.parts_dir):
+        os.makedirs(options.parts_dir)
+
+    test_ids = collect_tests(options.test_spec)
+
+    # timeouts are a decent upper bound if the test hasn't been timed yet
+    estimates = read_timeouts(test_ids)
+    durations = read_durations(options.durations)
+    estimates.update(durations)
+
+    start_time = time.time()
+    results = run_tests(test_ids, estimates, cores, options.test_cores,
+                        options.parts_dir, options.pytest_opts)
+    wall_time = time.time() - start_time
+
+    for test_id, (status, elapsed) in results.items():
+        durations[test_name(test_id)] = elapsed
+    write_durations(options.durations, durations)
+
+    tree, counts = merge_junit(test_ids, results, options.parts_dir, wall_time)
+    tree.write(options.xml_out, encoding='utf-8')
+
+    print('{} tests run in {} seconds with {} failures and {} errors'.format(
+        counts['tests'], int(wall_time), counts['failures'], counts['errors']))
+
+    return 1 if counts['failures'] > 0 or counts['errors'] > 0 else 0
+
+if __name__ == "__main__" :
+    sys.exit(main(sys.argv))
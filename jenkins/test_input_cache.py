@@ -0,0 +1,235 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+"""
+Tests for the VGCI input cache and ranged downloader in vgci.py, against a
+local HTTP server standing in for S3, and for the index cache.  Run with pytest jenkins/test_input_cache.py
+"""
+from __future__ import unicode_literals
+import os
+import shutil
+import tempfile
+import threading
+import time
+import hashlib
+import multiprocessing
+import BaseHTTPServer
+import SocketServer
+from unittest import TestCase
+
+import vgci
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    Serves files from memory like S3 does: with an ETag, Accept-Ranges and
+    206 responses to Range requests.  Ranges in truncate_ranges get their
+    body cut short the first time they are asked for.
+    """
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        # path to (data, etag)
+        self.files = dict()
+        self.truncate_ranges = set()
+        self.requests = []
+        self.lock = threading.Lock()
+
+    def url(self, path):
+        return 'http://127.0.0.1:{}{}'.format(self.server_port, path)
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.0'
+
+    def log_message(self, *args):
+        pass
+
+    def _headers(self, code, etag, length, content_range=None):
+        self.send_response(code)
+        self.send_header('Content-Length', str(length))
+        self.send_header('ETag', etag)
+        self.send_header('Accept-Ranges', 'bytes')
+        if content_range:
+            self.send_header('Content-Range', content_range)
+        self.end_headers()
+
+    def do_HEAD(self):
+        data, etag = self.server.files[self.path]
+        self._headers(200, etag, len(data))
+
+    def do_GET(self):
+        data, etag = self.server.files[self.path]
+        range_header = self.headers.getheader('Range')
+        with self.server.lock:
+            self.server.requests.append((self.path, range_header))
+        if not range_header:
+            self._headers(200, etag, len(data))
+            self.wfile.write(data)
+            return
+        start, end = [int(x) for x in range_header[len('bytes='):].split('-')]
+        body = data[start:end + 1]
+        self._headers(206, etag, len(body),
+                      'bytes {}-{}/{}'.format(start, end, len(data)))
+        with self.server.lock:
+            truncate = range_header in self.server.truncate_ranges
+            self.server.truncate_ranges.discard(range_header)
+        # a dropped connection partway through the range
+        self.wfile.write(body[:len(body) // 2] if truncate else body)
+
+def md5(data):
+    return hashlib.md5(data).hexdigest()
+
+class InputCacheTest(TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.work_dir, 'cache')
+        self.server = StandInServer()
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        # small parts, so small files take the ranged path
+        self.part_bytes = vgci.RANGE_PART_BYTES
+        vgci.RANGE_PART_BYTES = 1000
+
+    def tearDown(self):
+        vgci.RANGE_PART_BYTES = self.part_bytes
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.work_dir)
+
+    def _add_file(self, path, data, etag=None):
+        self.server.files[path] = (data, '"{}"'.format(etag or md5(data)))
+        return self.server.url(path)
+
+    def _entry_path(self, cache, path):
+        data, etag = self.server.files[path]
+        return cache._entry_path(self.server.url(path), etag, str(len(data)))
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def test_range_download_resumes_short_part(self):
+        """ A range cut short is fetched again, and the file comes out whole """
+        data = os.urandom(10500)
+        url = self._add_file('/reads.fq', data)
+        self.server.truncate_ranges.add('bytes=3000-3999')
+        cache = vgci.InputCache(self.cache_dir, 10 ** 6, download_threads=4)
+        tgt = os.path.join(self.work_dir, 'reads.fq')
+        cache.fetch(url, tgt)
+
+        self.assertEqual(self._read(tgt), data)
+        ranges = [r for p, r in self.server.requests if r is not None]
+        self.assertEqual(len(ranges), 12)
+        self.assertEqual(ranges.count('bytes=3000-3999'), 2)
+        self.assertIn('bytes=10000-10499', ranges)
+        self.assertTrue(os.path.isfile(self._entry_path(cache, '/reads.fq')))
+
+    def test_md5_mismatch(self):
+        """ A download not matching its MD5 ETag fails, and isn't cached """
+        url = self._add_file('/graph.vg', os.urandom(5000), etag=md5(b'something else'))
+        cache = vgci.InputCache(self.cache_dir, 10 ** 6, download_threads=4)
+        tgt = os.path.join(self.work_dir, 'graph.vg')
+        with self.assertRaises(IOError):
+            cache.fetch(url, tgt)
+        self.assertEqual(os.listdir(self.cache_dir), [vgci.InputCache.LOCK_NAME])
+        self.assertFalse(os.path.exists(tgt))
+
+    def test_lru_eviction(self):
+        """ The least recently used entry goes when the cache is over size,
+        and a hit counts as a use """
+        # small enough for single-stream downloads
+        urls = dict((name, self._add_file('/' + name, os.urandom(800)))
+                    for name in ['a', 'b', 'c'])
+        cache = vgci.InputCache(self.cache_dir, 2000)
+        entries = dict((name, self._entry_path(cache, '/' + name)) for name in urls)
+        tgt = os.path.join(self.work_dir, 'tgt')
+
+        cache.fetch(urls['a'], tgt)
+        cache.fetch(urls['b'], tgt)
+        # make the ages unambiguous: a is older than b
+        os.utime(entries['a'], (1000, 1000))
+        os.utime(entries['b'], (2000, 2000))
+
+        # hit a, which makes b the least recently used
+        cache.fetch(urls['a'], tgt)
+        self.assertEqual(os.stat(tgt).st_ino, os.stat(entries['a']).st_ino)
+        self.assertEqual(self._read(tgt), self.server.files['/a'][0])
+
+        cache.fetch(urls['c'], tgt)
+        self.assertTrue(os.path.isfile(entries['a']))
+        self.assertFalse(os.path.exists(entries['b']))
+        self.assertTrue(os.path.isfile(entries['c']))
+        self.assertEqual(self._read(tgt), self.server.files['/c'][0])
+
+    def test_hit_skips_get(self):
+        """ A hit is found from a HEAD request alone """
+        url = self._add_file('/index.xg', os.urandom(800))
+        cache = vgci.InputCache(self.cache_dir, 10 ** 6)
+        cache.fetch(url, os.path.join(self.work_dir, 'first'))
+        cache.fetch(url, os.path.join(self.work_dir, 'second'))
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(self._read(os.path.join(self.work_dir, 'second')),
+                         self.server.files['/index.xg'][0])
+
+    def test_concurrent_processes(self):
+        """ Processes sharing a cache too small for their inputs all get
+        whole files, though they keep evicting each other's entries """
+        urls = dict((name, self._add_file('/' + name, os.urandom(800)))
+                    for name in ['a', 'b', 'c'])
+
+        def worker(i):
+            cache = vgci.InputCache(self.cache_dir, 1000)
+            for j in range(20):
+                for name in sorted(urls):
+                    tgt = os.path.join(self.work_dir, '{}.{}'.format(name, i))
+                    cache.fetch(urls[name], tgt)
+                    if self._read(tgt) != self.server.files['/' + name][0]:
+                        os._exit(2)
+            os._exit(0)
+
+        procs = [multiprocessing.Process(target=worker, args=(i,)) for i in range(4)]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+        self.assertEqual([proc.exitcode for proc in procs], [0] * 4)
+        # and the cache ends up under size, holding one whole entry
+        entries = [n for n in os.listdir(self.cache_dir) if n != vgci.InputCache.LOCK_NAME]
+        self.assertEqual(len(entries), 1)
+
+class IndexCacheTest(TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.work_dir, 'cache')
+        self.builds_path = os.path.join(self.work_dir, 'builds')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_concurrent_builds(self):
+        """ Processes wanting the same index at once build it once between them """
+
+        def build_fn(out_dir):
+            with open(self.builds_path, 'a') as builds_file:
+                builds_file.write('built\n')
+            time.sleep(0.5)
+            with open(os.path.join(out_dir, 'graph.xg'), 'w') as xg_file:
+                xg_file.write('xg')
+
+        def worker(i):
+            cache = vgci.IndexCache(self.cache_dir)
+            out_store = os.path.join(self.work_dir, 'outstore-{}'.format(i))
+            cache.build(['graph.vg', 'v1.0', '-k 16'], out_store, build_fn)
+            with open(os.path.join(out_store, 'graph.xg')) as xg_file:
+                os._exit(0 if xg_file.read() == 'xg' else 2)
+
+        procs = [multiprocessing.Process(target=worker, args=(i,)) for i in range(4)]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+        self.assertEqual([proc.exitcode for proc in procs], [0] * 4)
+        with open(self.builds_path) as builds_file:
+            self.assertEqual(builds_file.read(), 'built\n')
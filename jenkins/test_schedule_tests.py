@@ -0,0 +1,121 @@
+#!/usr/bin/env python2.7
+# -*- coding: utf-8 -*-
+"""
+Tests for schedule-tests.py, running a stand-in pytest that sleeps and writes
+a JUnit report instead of running real VGCI tests.  Run with
+pytest jenkins/test_schedule_tests.py
+"""
+from __future__ import unicode_literals
+import os
+import io
+import imp
+import json
+import shutil
+import stat
+import sys
+import tempfile
+import time
+from unittest import TestCase
+
+schedule_tests = imp.load_source(
+    'schedule_tests', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schedule-tests.py'))
+
+# Sleeps as long as the plan for its test says, logs when it ran with how many
+# cores, then writes a report and exits with the planned status
+STAND_IN_PYTEST = '''#!{python}
+import json, os, sys, time
+test_id = [a for a in sys.argv[1:] if '::' in a][0]
+xml_path = [a.split('=', 1)[1] for a in sys.argv[1:] if a.startswith('--junitxml=')][0]
+name = test_id.split('::')[-1]
+with open(os.environ['STAND_IN_PLAN']) as plan_file:
+    seconds, status, report = json.load(plan_file)[name]
+start = time.time()
+time.sleep(seconds)
+with open(os.environ['STAND_IN_LOG'], 'a') as log_file:
+    log_file.write('{{}}\\t{{}}\\t{{}}\\t{{}}\\n'.format(name, start, time.time(), os.environ['VGCI_CORES']))
+if report:
+    with open(xml_path, 'w') as xml_file:
+        xml_file.write('<testsuite tests="1" failures="{{}}" errors="0" skips="0">'
+                       '<testcase name="{{}}"/></testsuite>'.format(int(status != 0), name))
+print('ran ' + name)
+sys.exit(status)
+'''
+
+class ScheduleTestsTest(TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        bin_dir = os.path.join(self.work_dir, 'bin')
+        os.makedirs(bin_dir)
+        pytest_path = os.path.join(bin_dir, 'pytest')
+        with io.open(pytest_path, 'w', encoding='utf8') as pytest_file:
+            pytest_file.write(STAND_IN_PYTEST.format(python=sys.executable))
+        os.chmod(pytest_path, os.stat(pytest_path).st_mode | stat.S_IXUSR)
+        self.parts_dir = os.path.join(self.work_dir, 'parts')
+        os.makedirs(self.parts_dir)
+        self.plan_path = os.path.join(self.work_dir, 'plan.json')
+        self.log_path = os.path.join(self.work_dir, 'ran.tsv')
+        self.environ = dict(os.environ)
+        os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+        os.environ['STAND_IN_PLAN'] = self.plan_path
+        os.environ['STAND_IN_LOG'] = self.log_path
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.work_dir)
+
+    def _run(self, plan, estimates, cores, test_cores):
+        """ run the tests in plan, a dict of name to (seconds, exit status,
+        whether to write a report), and get the test IDs, results and the
+        runs as (name, start, end, cores) in start order """
+        with open(self.plan_path, 'w') as plan_file:
+            json.dump(plan, plan_file)
+        test_ids = ['jenkins/vgci.py::VGCITest::{}'.format(name) for name in sorted(plan)]
+        results = schedule_tests.run_tests(test_ids, estimates, cores, test_cores,
+                                           self.parts_dir, '-vv')
+        runs = []
+        with open(self.log_path) as log_file:
+            for line in log_file:
+                name, start, end, run_cores = line.split()
+                runs.append((name, float(start), float(end), int(run_cores)))
+        return test_ids, results, sorted(runs, key=lambda run: run[1])
+
+    def test_concurrent_runs(self):
+        """ Tests run at once up to the core budget, longest first """
+        plan = dict(('test_{}'.format(i), (0.5 + 0.1 * i, 0, True)) for i in range(6))
+        estimates = dict((name, seconds) for name, (seconds, status, report) in plan.items())
+        start = time.time()
+        test_ids, results, runs = self._run(plan, estimates, 6, 2)
+        wall_time = time.time() - start
+
+        self.assertEqual(sorted(results.keys()), test_ids)
+        self.assertEqual([status for status, elapsed in results.values()], [0] * 6)
+        self.assertEqual(set(run[3] for run in runs), set([2]))
+        # the three longest go first, together
+        self.assertEqual(set(run[0] for run in runs[:3]), set(['test_5', 'test_4', 'test_3']))
+        for name, start_time, end_time, run_cores in runs[:3]:
+            self.assertLess(start_time, min(run[2] for run in runs[:3]))
+        # and never more than three at once
+        for name, start_time, end_time, run_cores in runs:
+            running = [run for run in runs if run[1] <= start_time < run[2]]
+            self.assertLessEqual(len(running), 3)
+        # which is quicker than one at a time
+        self.assertLess(wall_time, sum(estimates.values()) * 0.75)
+
+    def test_failures_reported(self):
+        """ A failed test and a test that left no report both come out as
+        failures in the merged report, and the rest as passes """
+        plan = {'test_pass' : (0.1, 0, True),
+                'test_fail' : (0.1, 1, True),
+                'test_crash' : (0.1, 3, False)}
+        test_ids, results, runs = self._run(plan, {}, 4, 1)
+        self.assertEqual(results['jenkins/vgci.py::VGCITest::test_crash'][0], 3)
+
+        tree, counts = schedule_tests.merge_junit(test_ids, results, self.parts_dir, 1.0)
+        self.assertEqual(counts['tests'], 3)
+        self.assertEqual(counts['failures'], 2)
+        testcases = dict((testcase.get('name'), testcase) for testcase in tree.getroot().iter('testcase'))
+        self.assertEqual(sorted(testcases.keys()), sorted(plan.keys()))
+        # the crashed test's log goes in its failure
+        self.assertIn('ran test_crash', testcases['test_crash'].find('failure').text)
@@ -20,9 +20,21 @@ import shutil
 import glob
 import traceback
 import io
+import array
+import hashlib
+import fcntl
+import contextlib
+import json
+import re
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from datetime import datetime
 
+import numpy as np
+
 import tsv
+import mapeval_plots
+import perf_history
 
 from toil_vg.vg_mapeval import get_default_mapeval_options, make_mapeval_plan, run_mapeval
 from toil_vg.vg_toil import parse_args
@@ -34,6 +46,414 @@ from toil.job import Job
 
 log = logging.getLogger(__name__)
 
+# Files bigger than this are downloaded as several concurrent ranged requests
+RANGE_PART_BYTES = 64 * 1024 ** 2
+# How many times to try a ranged request before giving up
+RANGE_ATTEMPTS = 3
+
+def _download_range(url, path, start, end):
+    """
+    Download bytes start-end (inclusive) of url into the same place in the
+    (preallocated) file at path, checking we got exactly the bytes we asked
+    for and retrying if not.
+    """
+    for attempt in range(RANGE_ATTEMPTS):
+        try:
+            request = urllib2.Request(url, headers={'Range' : 'bytes={}-{}'.format(start, end)})
+            connection = urllib2.urlopen(request)
+            try:
+                content_range = connection.info().getheader('Content-Range', '')
+                if connection.getcode() != 206 or not content_range.startswith(
+                        'bytes {}-{}/'.format(start, end)):
+                    raise IOError('Bad range response {} "{}" for {}'.format(
+                        connection.getcode(), content_range, url))
+                written = 0
+                # Each part gets its own handle, so seek + write acts like pwrite
+                with open(path, 'r+b') as f:
+                    f.seek(start)
+                    while True:
+                        buf = connection.read(1024 ** 2)
+                        if not buf:
+                            break
+                        f.write(buf)
+                        written += len(buf)
+                if written != end - start + 1:
+                    raise IOError('Got {} bytes instead of {} for range {}-{} of {}'.format(
+                        written, end - start + 1, start, end, url))
+                return
+            finally:
+                connection.close()
+        except (IOError, urllib2.URLError) as e:
+            if attempt + 1 == RANGE_ATTEMPTS:
+                raise
+            log.warning('Retrying range {}-{} of {}: {}'.format(start, end, url, e))
+
+def download_url(url, path, connection=None, threads=8):
+    """
+    Download url to path.  Big files from servers that support it (like S3)
+    are split into RANGE_PART_BYTES ranges that are fetched by a pool of 
+    threads straight into a preallocated file.  When the ETag is a plain MD5
+    (as it is for S3 objects not uploaded in parts), the result is checked
+    against it.
+    
+    connection, if given, is an already open connection to url.
+    """
+    if connection is None:
+        connection = urllib2.urlopen(url)
+    size = connection.info().getheader('Content-Length')
+    ranges_ok = connection.info().getheader('Accept-Ranges') == 'bytes'
+    etag = connection.info().getheader('ETag', '').strip('"')
+    
+    if not (ranges_ok and size and int(size) > RANGE_PART_BYTES and threads > 1):
+        # One stream will do
+        with open(path, 'w') as f:
+            # DON'T use an encoding here; the file may be binary
+            shutil.copyfileobj(connection, f)
+        connection.close()
+        return
+    
+    connection.close()
+    size = int(size)
+    with open(path, 'w') as f:
+        f.truncate(size)
+    parts = [(start, min(start + RANGE_PART_BYTES, size) - 1)
+             for start in range(0, size, RANGE_PART_BYTES)]
+    log.info('Downloading {} in {} parts\n'.format(url, len(parts)))
+    pool = ThreadPool(min(threads, len(parts)))
+    try:
+        pool.map(lambda part: _download_range(url, path, part[0], part[1]), parts)
+    finally:
+        pool.close()
+        pool.join()
+
+    if re.match('^[0-9a-f]{32}$', etag):
+        md5 = hashlib.md5()
+        with open(path, 'rb') as f:
+            for buf in iter(lambda: f.read(1024 ** 2), b''):
+                md5.update(buf)
+        if md5.hexdigest() != etag:
+            raise IOError('MD5 {} of download does not match ETag {} of {}'.format(
+                md5.hexdigest(), etag, url))
+
+def link_or_copy(src, tgt):
+    """ hard link src to tgt, replacing tgt, or copy it if we can't link """
+    if os.path.lexists(tgt):
+        os.remove(tgt)
+    try:
+        os.link(src, tgt)
+    except OSError:
+        # probably on another device
+        shutil.copy2(src, tgt)
+
+@contextlib.contextmanager
+def file_lock(path):
+    """ hold an exclusive flock on path (made if need be) for the duration, so
+    other processes doing the same wait """
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+class InputCache(object):
+    """
+    Persistent on-disk cache for test inputs downloaded from URLs, so the same
+    graphs, indexes and reads don't get fetched again by every test and every
+    run.  Entries are named by a digest of the URL and the ETag and size the
+    server reports, so a changed remote file is a miss.  The least recently 
+    used entries are evicted to keep the total size under max_bytes.  Hits are
+    hard-linked (or copied if that's not possible) to their targets.
+
+    Several processes can share a cache: linking out an entry and evicting
+    are done holding a lock on a file in the cache directory, so one process
+    never evicts an entry another is in the middle of using.
+    """
+    LOCK_NAME = 'lock'
+
+    def __init__(self, cache_dir, max_bytes, download_threads=8):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.download_threads = download_threads
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def _entry_path(self, url, etag, size):
+        """ path of the cache entry for the given URL and remote version """
+        digest = hashlib.sha1('{}\t{}\t{}'.format(url, etag, size).encode('utf8')).hexdigest()
+        return os.path.join(self.cache_dir, digest)
+
+    def _lock(self):
+        """ lock the whole cache """
+        return file_lock(os.path.join(self.cache_dir, self.LOCK_NAME))
+
+    def _link(self, entry_path, tgt):
+        """ put a cache entry at tgt and mark it as recently used """
+        link_or_copy(entry_path, tgt)
+        os.utime(entry_path, None)
+
+    def _evict(self, keep):
+        """ delete least recently used entries until we fit in max_bytes """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if (os.path.isfile(path) and not name.startswith('tmp') and
+                name != self.LOCK_NAME):
+                st = os.stat(path)
+                entries.append((st.st_mtime, st.st_size, path))
+        total = sum(e[1] for e in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path != keep:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total -= size
+
+    def _use(self, entry_path, tgt):
+        """ link entry_path to tgt and evict around it, if it's still there.
+        Returns False if it was evicted first. Needs the lock. """
+        if not os.path.isfile(entry_path):
+            return False
+        self._link(entry_path, tgt)
+        self._evict(entry_path)
+        return True
+
+    def _remote_version(self, url):
+        """ get the ETag and size of url from a HEAD request, or Nones if the
+        server won't say """
+        request = urllib2.Request(url)
+        request.get_method = lambda: 'HEAD'
+        try:
+            connection = urllib2.urlopen(request)
+        except urllib2.HTTPError as e:
+            log.info('HEAD of {} failed: {}\n'.format(url, e))
+            return None, None
+        try:
+            return (connection.info().getheader('ETag'),
+                    connection.info().getheader('Content-Length'))
+        finally:
+            connection.close()
+
+    def fetch(self, url, tgt):
+        """ download url to tgt, going through the cache """
+        etag, size = self._remote_version(url)
+        if not etag and not size:
+            # Nothing to tell versions apart with, so don't cache
+            log.info('Download {} (uncacheable)...\n'.format(url))
+            if os.path.lexists(tgt):
+                os.remove(tgt)
+            download_url(url, tgt, None, self.download_threads)
+            return
+
+        entry_path = self._entry_path(url, etag, size)
+        with self._lock():
+            if self._use(entry_path, tgt):
+                log.info('Found {} in cache {}\n'.format(url, self.cache_dir))
+                return
+
+        log.info('Download {}...\n'.format(url))
+        # Download next to the entry and move into place once complete, so an
+        # interrupted download is never mistaken for a hit.  This is done
+        # without the lock, so other processes aren't held up behind it; if
+        # someone else downloads the same entry meanwhile, the last one wins.
+        fd, tmp_path = tempfile.mkstemp(prefix='tmp', dir=self.cache_dir)
+        os.close(fd)
+        try:
+            download_url(url, tmp_path, None, self.download_threads)
+            with self._lock():
+                os.rename(tmp_path, entry_path)
+                self._use(entry_path, tgt)
+        except:
+            if os.path.lexists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+class IndexCache(object):
+    """
+    Cache of indexes built by toil-vg index, shared between tests, so each
+    distinct index is only built once per suite run.  Entries are directories
+    holding the files a build made, named by a digest of everything that went
+    into it (input graph digests, vg version and indexing options).  Hits are
+    hard-linked (or copied) into the outstore, so it stays complete when
+    archived after the cache is gone.
+
+    Tests running at once in different processes can share the cache.  Each
+    entry has a lock file next to it that is held while checking for and
+    building the entry, so when two tests want the same index one builds it
+    and the other waits and then uses it.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+    def build(self, key_parts, out_store, build_fn):
+        """
+        Put the index files for the given key in out_store, calling
+        build_fn(dir) to make them in dir first if they're not cached
+        """
+        digest = hashlib.sha1('\t'.join(key_parts).encode('utf8')).hexdigest()
+        entry_path = os.path.join(self.cache_dir, digest)
+        with file_lock(entry_path + '.lock'):
+            if os.path.isdir(entry_path):
+                log.info('Found index {} in cache {}\n'.format(digest, self.cache_dir))
+            else:
+                # Build off to the side so a failed build is never mistaken for a hit
+                tmp_path = tempfile.mkdtemp(prefix='tmp', dir=self.cache_dir)
+                try:
+                    build_fn(tmp_path)
+                except:
+                    shutil.rmtree(tmp_path)
+                    raise
+                os.rename(tmp_path, entry_path)
+
+        if not os.path.isdir(out_store):
+            os.makedirs(out_store)
+        for name in os.listdir(entry_path):
+            tgt = os.path.join(out_store, name)
+            if os.path.lexists(tgt):
+                if os.path.isdir(tgt) and not os.path.islink(tgt):
+                    shutil.rmtree(tgt)
+                else:
+                    os.remove(tgt)
+            self._link_tree(os.path.join(entry_path, name), tgt)
+
+    def _link_tree(self, src, tgt):
+        """ link_or_copy src to tgt, recursing into directories """
+        if os.path.isdir(src):
+            os.makedirs(tgt)
+            for name in os.listdir(src):
+                self._link_tree(os.path.join(src, name), os.path.join(tgt, name))
+        else:
+            link_or_copy(src, tgt)
+
+class MapTimeHandler(logging.Handler):
+    """
+    Collects the running times of the vg map (or vg mpmap, or bwa) calls that
+    toil-vg mapeval reports through the RealtimeLogger, like
+    Aligned /tmp/toil-55082/aligned-snp1kg_HG00096_0.gam. Process took 4.37375712395 seconds with single-end vg-map
+    totalled by the keys used in stats.tsv (ex snp1kg-se, primary-mp-pe, bwa-mem-pe).
+    mine-logs.py pulls the same lines out of the log for the report, with the
+    same perf_history.parse_runtime.
+    """
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.runtimes = collections.defaultdict(float)
+
+    def emit(self, record):
+        try:
+            runtime = perf_history.parse_runtime(record.getMessage())
+        except Exception:
+            return
+        if runtime is not None:
+            key, seconds = runtime
+            self.runtimes[key] += seconds
+
+def read_hashes(names):
+    """ hash read names into an int64 array, so reads can be matched up without
+    holding on to their names """
+    return np.fromiter((hash(name) for name in names), dtype=np.int64, count=len(names))
+
+class ScoreIndex(object):
+    """
+    A .scores file from toil-vg mapeval's score comparison (lines of read name,
+    score difference, aligned score, baseline score), parsed once into arrays
+    of read name hashes and score differences.  The names of the reads that
+    got worse are kept, for reporting.
+    """
+    def __init__(self, path):
+        hashes = []
+        diffs = []
+        self.worse = []
+        with io.open(path, 'r', encoding='utf8') as score_file:
+            for line in score_file:
+                if line.strip() == '':
+                    continue
+                parts = line.split(', ')
+                score_diff = int(parts[1])
+                hashes.append(hash(parts[0]))
+                diffs.append(score_diff)
+                if score_diff < 0:
+                    self.worse.append((parts[0], score_diff))
+        self.hashes = np.array(hashes, dtype=np.int64)
+        self.diffs = np.array(diffs, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.diffs)
+
+    def worse_hashes(self):
+        """ get the read_hashes() of the reads whose score went down """
+        return self.hashes[self.diffs < 0]
+
+    def worse_reads(self):
+        """ get (read name, score difference) for the reads whose score went down """
+        return self.worse
+
+class PositionResults(object):
+    """
+    The position.results.tsv table from toil-vg mapeval (one row per read per
+    aligner), loaded once into typed columns so that all the subsets we plot
+    can be taken with boolean masks over its rows instead of rescanning the
+    file.  The file is parsed in one streaming pass into compact buffers:
+    correct and mq are ints, aligner is a code into the sorted aligner_names,
+    and reads are only kept as their read_hashes().
+    """
+    def __init__(self, path):
+        correct = array.array(b'b')
+        mq = array.array(b'i')
+        aligner_codes = array.array(b'H')
+        hashes = array.array(b'l')
+        # aligner name to code, in order of appearance
+        codes = dict()
+        with io.open(path, 'r', encoding='utf8') as results_file:
+            header = [name.strip('"') for name in results_file.readline().split()]
+            correct_col = header.index('correct')
+            mq_col = header.index('mq')
+            aligner_col = header.index('aligner')
+            read_col = header.index('read')
+            for line in results_file:
+                toks = line.split()
+                if len(toks) == 0:
+                    continue
+                correct.append(int(toks[correct_col].strip('"')))
+                mq.append(int(toks[mq_col].strip('"')))
+                aligner = toks[aligner_col].strip('"')
+                if aligner not in codes:
+                    codes[aligner] = len(codes)
+                aligner_codes.append(codes[aligner])
+                hashes.append(hash(toks[read_col].strip('"')))
+
+        self.correct = np.frombuffer(correct, dtype=np.int8)
+        self.mq = np.frombuffer(mq, dtype=np.dtype(b'i'))
+        self.hashes = np.frombuffer(hashes, dtype=np.dtype(b'l')).astype(np.int64, copy=False)
+        # recode so codes sort like names, and groups come out in name order
+        self.aligner_names = np.array(sorted(codes.keys()))
+        recode = np.zeros(max(len(codes), 1), dtype=np.uint16)
+        for aligner, code in codes.items():
+            recode[code] = np.searchsorted(self.aligner_names, aligner)
+        self.aligners = recode[np.frombuffer(aligner_codes, dtype=np.uint16)]
+
+    def __len__(self):
+        return len(self.correct)
+
+    def aligner_rows(self, aligner):
+        """ get a mask of the rows for the given aligner """
+        codes = np.flatnonzero(self.aligner_names == aligner)
+        if len(codes) == 0:
+            return np.zeros(len(self), dtype=bool)
+        return self.aligners == codes[0]
+
+    def aligner_in(self, aligners):
+        """ get a mask of the rows whose aligner is one of the given ones """
+        return np.in1d(self.aligners, np.flatnonzero(np.in1d(self.aligner_names, aligners)))
+
+    def read_hashes(self):
+        """ get the read_hashes() of the read column """
+        return self.hashes
 
 class VGCITest(TestCase):
     """
@@ -60,11 +480,35 @@ class VGCITest(TestCase):
         self.do_teardown = True
         self.baseline = 's3://cgl-pipeline-inputs/vg_cgl/vg_ci/jenkins_regression_baseline'
         self.cores = 8
+        # where to keep downloaded inputs between tests and runs (None to
+        # disable). jenkins.sh points this at the big scratch disk.
+        self.cache_dir = None
+        # max size of the input cache, in GB
+        self.cache_size = 50
+        # number of concurrent ranged requests to use for big downloads
+        self.download_threads = 8
+        # where to share built indexes between tests ("None" to disable)
+        self.index_cache_dir = os.path.join(tempfile.gettempdir(), 'vgci-index-cache')
+        # How much (as a fraction) can vg map throughput drop below baseline?
+        self.map_throughput_tolerance = 0.25
+        # What to do when it drops more: "warn" or "fail"
+        self.map_throughput_gate = 'warn'
 
         self.loadCFG()
 
+        self.input_cache = None
+        if self.cache_dir and self.cache_dir != 'None':
+            self.input_cache = InputCache(self.cache_dir, int(self.cache_size * 1024 ** 3),
+                                          self.download_threads)
+        self.index_cache = None
+        if self.index_cache_dir and self.index_cache_dir != 'None':
+            self.index_cache = IndexCache(self.index_cache_dir)
+
         # These are samples that are in 1KG but not in the bakeoff snp1kg graphs. 
         self.bakeoff_removed_samples = set(['NA128{}'.format(x) for x in range(77, 94)])
+
+        # ScoreIndexes of mapeval score comparisons by path, shared by plotting and verification
+        self.score_indexes = dict()
                 
     def tearDown(self):
         shutil.rmtree(self.tempdir)        
@@ -98,6 +542,23 @@ class VGCITest(TestCase):
                             self.baseline = toks[1]
                         elif toks[0] == 'cores':
                             self.cores = int(toks[1])
+                        elif toks[0] == 'cache_dir':
+                            self.cache_dir = toks[1]
+                        elif toks[0] == 'cache_size':
+                            self.cache_size = float(toks[1])
+                        elif toks[0] == 'download_threads':
+                            self.download_threads = int(toks[1])
+                        elif toks[0] == 'index_cache_dir':
+                            self.index_cache_dir = toks[1]
+                        elif toks[0] == 'map_throughput_tolerance':
+                            self.map_throughput_tolerance = float(toks[1])
+                        elif toks[0] == 'map_throughput_gate':
+                            self.map_throughput_gate = toks[1].lower()
+
+        # when run through schedule-tests.py, each test gets its own slice of
+        # the cores instead of assuming it has the whole machine
+        if os.getenv('VGCI_CORES'):
+            self.cores = int(os.getenv('VGCI_CORES'))
 
     def _jobstore(self, tag = ''):
         return os.path.join(self.workdir, 'jobstore{}'.format(tag))
@@ -170,13 +631,30 @@ class VGCITest(TestCase):
             # Convert to a public HTTPS URL
             src = 'https://{}.s3.amazonaws.com{}'.format(bname, keyname)
         
+        if self.input_cache:
+            self.input_cache.fetch(src, tgt)
+            return
+        
         log.info('Download {}...\n'.format(src))
         
-        with open(tgt, 'w') as f:
-            # Download the file from the URL
-            # DON'T use an encoding here; the file may be binary
-            connection = urllib2.urlopen(src)
-            shutil.copyfileobj(connection, f)
+        # tgt may be a hard link into the cache, which we mustn't write through
+        if os.path.lexists(tgt):
+            os.remove(tgt)
+        download_url(src, tgt, threads=self.download_threads)
+
+    def _get_remote_files(self, downloads):
+        """
+        get several (src, tgt) files from a store at once
+        """
+        if len(downloads) > 1:
+            pool = ThreadPool(len(downloads))
+            try:
+                pool.map(lambda d: self._get_remote_file(d[0], d[1]), downloads)
+            finally:
+                pool.close()
+                pool.join()
+        elif len(downloads) == 1:
+            self._get_remote_file(downloads[0][0], downloads[0][1])
 
     def _begin_message(self, name = None, is_tsv = False, ):
         """ Used by mine-logs.py to flag that we're about to write something we want to mine
@@ -192,10 +670,35 @@ class VGCITest(TestCase):
     def _end_message(self):
         """ Finish writing something mineable to stdout """
         print '</VGCI>\n'
+
+    def _results_path(self, tag):
+        return os.path.join(self._outstore(tag), 'vgci_results.jsonl')
+
+    def _clear_results(self, tag):
+        """ Forget the tables reported to the outstore by an earlier run of
+        the test, since the outstore isn't cleared between runs """
+        if os.path.isfile(self._results_path(tag)):
+            os.remove(self._results_path(tag))
+
+    def _report_table(self, tag, name, table):
+        """ Report a table (list of rows, header first) to mine-logs.py.  It
+        is appended as a JSON record to vgci_results.jsonl in the outstore,
+        which mine-logs.py reads directly, and also printed in VGCI tags so it
+        shows up in the log.  Tests start by calling _clear_results. """
+        self._begin_message(name, is_tsv=True)
+        for row in table:
+            print '\t'.join([unicode(col) for col in row])
+        self._end_message()
+
+        with io.open(self._results_path(tag), 'a', encoding='utf8') as results_file:
+            results_file.write(unicode(json.dumps({'name' : name, 'table' : table}, ensure_ascii=False)) + '\n')
                 
-    def _toil_vg_index(self, chrom, graph_path, xg_path, gcsa_path, misc_opts, dir_tag, file_tag):
-        """ Wrap toil-vg index.  Files passed are copied from store instead of computed """
-        job_store = self._jobstore(dir_tag)
+    def _toil_vg_index(self, chrom, graph_path, xg_path, gcsa_path, misc_opts, dir_tag, file_tag,
+                       job_tag = None):
+        """ Wrap toil-vg index.  Files passed are copied from store instead of computed.
+        job_tag, if given, selects a job store other than the one for dir_tag, so
+        several indexes can be built into the same outstore at once """
+        job_store = self._jobstore(job_tag if job_tag is not None else dir_tag)
         out_store = self._outstore(dir_tag)
         opts = '--realTimeLogging --logInfo '
         if self.vg_docker:
@@ -206,20 +709,93 @@ class VGCITest(TestCase):
             opts += '--chroms {} '.format(chrom)
         if graph_path:
             opts += '--graphs {} '.format(graph_path)
+        # fetch the indexes we're given all at once
+        downloads = []
         if xg_path:
             opts += '--skip_xg '
-            self._get_remote_file(xg_path, os.path.join(out_store, os.path.basename(xg_path)))
+            downloads.append((xg_path, os.path.join(out_store, os.path.basename(xg_path))))
         if gcsa_path and (not misc_opts or '--skip_gcsa' not in misc_opts):
             opts += '--skip_gcsa '
-            self._get_remote_file(gcsa_path, os.path.join(out_store, os.path.basename(gcsa_path)))
-            self._get_remote_file(gcsa_path + '.lcp', os.path.join(out_store, os.path.basename(gcsa_path) + '.lcp'))
+            downloads.append((gcsa_path, os.path.join(out_store, os.path.basename(gcsa_path))))
+            downloads.append((gcsa_path + '.lcp', os.path.join(out_store, os.path.basename(gcsa_path) + '.lcp')))
+        self._get_remote_files(downloads)
         opts += '--index_name {}'.format(file_tag)
         if misc_opts:
             opts += ' {} '.format(misc_opts)
         
-        cmd = 'toil-vg index {} {} {}'.format(job_store, out_store, opts)
-        
-        subprocess.check_call(cmd, shell=True)        
+        vg_version = self._vg_version()
+        if self.index_cache is None or vg_version is None:
+            cmd = 'toil-vg index {} {} {}'.format(job_store, out_store, opts)
+            subprocess.check_call(cmd, shell=True)
+            return
+
+        # Key the build on what goes into it, with files named by their contents
+        key_parts = [vg_version, unicode(chrom), file_tag, unicode(bool(xg_path)),
+                     unicode('--skip_gcsa' in opts), self._input_digest(graph_path)]
+        if misc_opts:
+            key_parts += [self._input_digest(tok) if os.path.isfile(tok) else tok
+                          for tok in self._key_opts(misc_opts.split())]
+        def build_fn(build_dir):
+            cmd = 'toil-vg index {} {} {}'.format(job_store, build_dir, opts)
+            subprocess.check_call(cmd, shell=True)
+        self.index_cache.build(key_parts, out_store, build_fn)
+
+    def _vg_version(self):
+        """ get the version of the vg we're testing, or None if we can't tell """
+        if not hasattr(VGCITest, '_vg_version_cache'):
+            if self.container == 'None' or self.vg_docker == 'None':
+                cmd = ['vg', 'version']
+            elif self.vg_docker:
+                cmd = ['docker', 'run', self.vg_docker, 'vg', 'version']
+            else:
+                # toil-vg picks the docker image, so we don't know the version
+                cmd = None
+            try:
+                VGCITest._vg_version_cache = subprocess.check_output(cmd).decode('utf8').strip() if cmd else None
+            except (OSError, subprocess.CalledProcessError):
+                VGCITest._vg_version_cache = None
+        return VGCITest._vg_version_cache
+
+    def _key_opts(self, opts):
+        """ drop the core and thread counts from a list of options, as they
+        don't change what gets built """
+        key_opts = []
+        skip = False
+        for tok in opts:
+            if skip:
+                skip = False
+            elif tok.startswith('--') and tok.split('=')[0].endswith(('_cores', 'threads')):
+                # the value follows unless given as --opt=value
+                skip = '=' not in tok
+            else:
+                key_opts.append(tok)
+        return key_opts
+
+    def _input_digest(self, path):
+        """ identify the contents of a test input: the SHA1 of a local file, or
+        the ETag, Last-Modified and size a URL's HEAD reports """
+        if not path:
+            return ''
+        if os.path.isfile(path):
+            sha1 = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for buf in iter(lambda: f.read(1024 ** 2), b''):
+                    sha1.update(buf)
+            return sha1.hexdigest()
+        url = path
+        if url.startswith('s3://'):
+            toks = url[5:].split('/')
+            url = 'https://{}.s3.amazonaws.com/{}'.format(toks[0], '/'.join(toks[1:]))
+        # don't download the whole thing just to get its headers
+        request = urllib2.Request(url)
+        request.get_method = lambda: 'HEAD'
+        connection = urllib2.urlopen(request)
+        try:
+            info = connection.info()
+            return '{} {} {} {}'.format(url, info.getheader('ETag'), info.getheader('Last-Modified'),
+                                        info.getheader('Content-Length'))
+        finally:
+            connection.close()
         
         
     def _toil_vg_run(self, sample_name, chrom, graph_path, xg_path, gcsa_path, fq_path,
@@ -273,11 +849,31 @@ class VGCITest(TestCase):
         this only supports one chromosome at a time, presently.
         the indexes are written as thread_0.xg and thread_1.xg in the
         output store (derived from tag parameter like other methods)
+
+        The indexes are cached by graph, VCF, sample and region, so reruns
+        and other tests extracting the same threads reuse them.
         """
-        job_store = self._jobstore(tag)
         out_store = self._outstore(tag)
-        out_store_name = self._outstore_name(tag)
+        index_names = ['index-gpbwt', 'thread_0', 'thread_1']
 
+        vg_version = self._vg_version()
+        if self.index_cache is None or vg_version is None:
+            self._extract_threads(sample, vg_file, vcf_file, region, tag)
+        else:
+            key_parts = ['threads', vg_version, self._input_digest(vg_file),
+                         self._input_digest(vcf_file), sample, region]
+            def build_fn(build_dir):
+                self._extract_threads(sample, vg_file, vcf_file, region, tag)
+                for name in index_names:
+                    # the outstore files may themselves be links into the cache
+                    link_or_copy(os.path.realpath(os.path.join(out_store, name + '.xg')),
+                                 os.path.join(build_dir, name + '.xg'))
+            self.index_cache.build(key_parts, out_store, build_fn)
+
+        return tuple(os.path.join(out_store, name + '.xg') for name in index_names)
+
+    def _thread_context(self, tag, cores):
+        """ Make a toil-vg context for the thread extraction steps """
         # What do we want to override from the default toil-vg config?
         overrides = argparse.Namespace(
             # toil-vg options
@@ -286,21 +882,29 @@ class VGCITest(TestCase):
             # Toil options
             realTimeLogging = True,
             logLevel = "INFO",
-            maxCores = self.cores
+            maxCores = cores
         )
 
-        # Make the context
-        context = Context(out_store, overrides)
+        return Context(self._outstore(tag), overrides)
 
-        # The unfiltered and filtered vcf file
-        uf_vcf_file = os.path.join(self.workdir, 'uf-' + os.path.basename(vcf_file))
-        f_vcf_file = os.path.join(self.workdir, 'f-' + os.path.basename(vcf_file))
+    def _extract_threads(self, sample, vg_file, vcf_file, region, tag=''):
+        """ Build index-gpbwt.xg, thread_0.xg and thread_1.xg for
+        _make_thread_indexes in the output store.  The two haplotypes are
+        extracted and indexed in parallel, with half the cores each. """
+        job_store = self._jobstore(tag)
+        out_store = self._outstore(tag)
+        context = self._thread_context(tag, self.cores)
+
+        # The unfiltered and filtered vcf file (tagged, as other tests may be
+        # running in the same work directory at the same time)
+        uf_vcf_file = os.path.join(self.workdir, 'uf-{}-'.format(tag) + os.path.basename(vcf_file))
+        f_vcf_file = os.path.join(self.workdir, 'f-{}-'.format(tag) + os.path.basename(vcf_file))
         if not f_vcf_file.endswith('.gz'):
             f_vcf_file += '.gz'
         
         # Get the inputs
-        self._get_remote_file(vg_file, os.path.join(out_store, os.path.basename(vg_file)))
-        self._get_remote_file(vcf_file, uf_vcf_file)
+        self._get_remote_files([(vg_file, os.path.join(out_store, os.path.basename(vg_file))),
+                                (vcf_file, uf_vcf_file)])
 
         # Reduce our VCF to just the sample of interest to save time downstream
         with context.get_toil(job_store) as toil:
@@ -323,43 +927,62 @@ class VGCITest(TestCase):
         os.remove(f_vcf_file)
         os.remove(f_vcf_file + '.tbi')
         
-        # Extract both haplotypes of the given sample as their own graphs
-        # (this is done through vg directly)
+        # Extract both haplotypes of the given sample as their own graphs at
+        # the same time.  Each gets its own process (Toil wants to be in the
+        # main thread) and its own job store.
+        procs = []
         for hap in [0, 1]:
-            tmp_thread_path = os.path.abspath(os.path.join(self.workdir, 'thread_{}.vg'.format(hap)))
-
-            # This is straght from Erik.  We mush together the original graph
-            # (without paths) and the thread path from the xg index
-            with context.get_toil(job_store) as toil:
-                cmd = ['vg', 'mod', '-D', os.path.join(out_store_name, os.path.basename(vg_file))]
-                toil.start(Job.wrapJobFn(toil_call, context, cmd,
-                                         work_dir = os.path.abspath(self.workdir),
-                                         out_path = tmp_thread_path))
-
-                # note: I'm not sure why that _0 is there but all threads seem
-                # to have names like _thread_NA12878_17_0_0 and _thread_NA12878_17_1_0
-                cmd = ['vg', 'find', '-q', '_thread_{}_{}_{}_0'.format(sample, chrom, hap),
-                       '-x', os.path.join(out_store_name, os.path.basename(index_path))]
-                toil.start(Job.wrapJobFn(toil_call, context, cmd,
-                                         work_dir = os.path.abspath(self.workdir),
-                                         out_path = tmp_thread_path,
-                                         out_append = True))
-
-                # Then we trim out anything other than our thread path
-                cmd = ['vg', 'mod', '-N', os.path.basename(tmp_thread_path)]
-                toil.start(Job.wrapJobFn(toil_call, context, cmd,
-                                         work_dir = os.path.abspath(self.workdir),
-                                         out_path = tmp_thread_path + '.drop'))
-
-            # Index the thread graphs so we can simulate from them
-            self._toil_vg_index(chrom, tmp_thread_path + '.drop', None, None,
-                                '--skip_gcsa', tag, 'thread_{}'.format(hap))
-
-            # They're in a tmp work dir so this is probably overkill
-            os.remove(tmp_thread_path)
-            os.remove(tmp_thread_path + '.drop')
-
-        return index_path, os.path.join(out_store, 'thread_0.xg'), os.path.join(out_store, 'thread_1.xg')
+            proc = multiprocessing.Process(target=self._extract_thread,
+                                           args=(sample, chrom, hap, vg_file, index_path, tag))
+            proc.start()
+            procs.append(proc)
+        for proc in procs:
+            proc.join()
+        for hap, proc in enumerate(procs):
+            if proc.exitcode != 0:
+                raise RuntimeError('Extracting thread {} of {} failed with exit code {}'.format(
+                    hap, sample, proc.exitcode))
+
+    def _extract_thread(self, sample, chrom, hap, vg_file, index_path, tag=''):
+        """ Extract one haplotype of the given sample as its own graph
+        (through vg directly) and index it as thread_<hap>.xg """
+        job_tag = '{}-thread{}'.format(tag, hap)
+        job_store = self._jobstore(job_tag)
+        out_store_name = self._outstore_name(tag)
+        context = self._thread_context(tag, max(1, self.cores / 2))
+        
+        tmp_thread_path = os.path.abspath(os.path.join(self.workdir, 'thread_{}-{}.vg'.format(hap, tag)))
+
+        # This is straght from Erik.  We mush together the original graph
+        # (without paths) and the thread path from the xg index
+        with context.get_toil(job_store) as toil:
+            cmd = ['vg', 'mod', '-D', os.path.join(out_store_name, os.path.basename(vg_file))]
+            toil.start(Job.wrapJobFn(toil_call, context, cmd,
+                                     work_dir = os.path.abspath(self.workdir),
+                                     out_path = tmp_thread_path))
+
+            # note: I'm not sure why that _0 is there but all threads seem
+            # to have names like _thread_NA12878_17_0_0 and _thread_NA12878_17_1_0
+            cmd = ['vg', 'find', '-q', '_thread_{}_{}_{}_0'.format(sample, chrom, hap),
+                   '-x', os.path.join(out_store_name, os.path.basename(index_path))]
+            toil.start(Job.wrapJobFn(toil_call, context, cmd,
+                                     work_dir = os.path.abspath(self.workdir),
+                                     out_path = tmp_thread_path,
+                                     out_append = True))
+
+            # Then we trim out anything other than our thread path
+            cmd = ['vg', 'mod', '-N', os.path.basename(tmp_thread_path)]
+            toil.start(Job.wrapJobFn(toil_call, context, cmd,
+                                     work_dir = os.path.abspath(self.workdir),
+                                     out_path = tmp_thread_path + '.drop'))
+
+        # Index the thread graphs so we can simulate from them
+        self._toil_vg_index(chrom, tmp_thread_path + '.drop', None, None,
+                            '--skip_gcsa', tag, 'thread_{}'.format(hap), job_tag = job_tag)
+
+        # They're in a tmp work dir so this is probably overkill
+        os.remove(tmp_thread_path)
+        os.remove(tmp_thread_path + '.drop')
 
     def _verify_f1(self, sample, tag='', threshold=None):
         # grab the f1.txt file from the output store
@@ -376,9 +999,8 @@ class VGCITest(TestCase):
         if not threshold:
             threshold = self.f1_threshold
 
-        # print the whole table in tags that mine-logs can read
-        self._begin_message('vcfeval Results'.format(
-            f1_score, baseline_f1, threshold), is_tsv=True)
+        # report the whole table for mine-logs
+        table = []
         summary_path = f1_path[0:-6] + 'summary.txt'
         with io.open(summary_path, 'r', encoding='utf8') as summary_file:
             for i, line in enumerate(summary_file):
@@ -390,8 +1012,8 @@ class VGCITest(TestCase):
                         toks += [baseline_f1, threshold]
                     elif i > 2:
                         toks += ['N/A', 'N/A']
-                    print '\t'.join([unicode(tok) for tok in toks])
-        self._end_message()
+                    table.append(toks)
+        self._report_table(tag, 'vcfeval Results', table)
 
         self.assertGreaterEqual(f1_score, baseline_f1 - threshold)
 
@@ -399,6 +1021,7 @@ class VGCITest(TestCase):
         """ Run bakeoff F1 test for NA12878 """
         assert not tag_ext or tag_ext.startswith('-')
         tag = '{}-{}{}'.format(region, graph, tag_ext)
+        self._clear_results(tag)
         chrom, offset = self._bakeoff_coords(region)        
         if skip_indexing:
             xg_path = None
@@ -550,134 +1173,127 @@ class VGCITest(TestCase):
                 
             # Output files all live in the out_store, but if we wanted to we could export them also/instead.
             
-            # Run the root job
-            returned = toil.start(main_job)
+            # Run the root job, listening for the map times on the way
+            map_times = MapTimeHandler()
+            logging.getLogger().addHandler(map_times)
+            try:
+                returned = toil.start(main_job)
+            finally:
+                logging.getLogger().removeHandler(map_times)
             
             # TODO: I want to do the evaluation here, working with file IDs, but
             # since we put the results in the out store maybe it really does
             # make sense to just go through the files in the out store.
 
-    def _filter_position_file(self, position_file, out_file):
-        """ Filter reads that fail score check out of a position comparison file
-        Return number of reads filtered """
-
-        # check if a read has been filtered by looking in the primary score comparison output
-        reads_map = dict()
-        def is_filtered(read, method):
-            if method not in reads_map:
-                reads_map[method] = set()
-                try:
-                    # -se not currently in filenames. ugh. 
-                    name = method[0:-3] if method.endswith('-se') else method
-                    score_path = os.path.join(os.path.dirname(position_file),
-                                              '{}.compare.primary.scores'.format(name))
-                    with io.open(score_path, 'r', encoding='utf8') as score_file:
-                        for line in score_file:
-                            toks = line.split(", ")
-                            if int(toks[1]) < 0:
-                                reads_map[method].add(toks[0])
-                except:
-                    pass
-            return read in reads_map[method]
-
-        # scan postions, filtering all reads in our set
-        filter_count = 0
-        with io.open(position_file, 'r', encoding='utf8') as pf, io.open(out_file, 'w', encoding='utf8') as of:
-            for i, line in enumerate(pf):
-                toks = line.rstrip().split()
-                if i == 0:
-                    ridx = toks.index('read')
-                    aidx = toks.index('aligner')                
-                if i == 0 or not is_filtered(toks[ridx], toks[aidx].strip('"')):
-                    of.write(line)
-                else:
-                    filter_count += 1
-        return filter_count
+        self._write_map_throughput(reads, map_times.runtimes, tag)
+
+    def _write_map_throughput(self, reads, runtimes, tag):
+        """ Save the mapping throughput (reads per second per core) of each
+        vg map and mpmap run as map_throughput.tsv in the outstore, next to
+        stats.tsv, where it becomes the baseline for later runs """
+        with io.open(os.path.join(self._outstore(tag), 'map_throughput.tsv'), 'w', encoding='utf8') as tp_file:
+            tp_file.write('method\treads/s/core\n')
+            for key in sorted(runtimes.keys()):
+                if not key.startswith('bwa') and runtimes[key] > 0:
+                    tp_file.write('{}\t{}\n'.format(key, reads / (runtimes[key] * self.cores)))
+
+    def _verify_map_throughput(self, tag, tolerance=None):
+        """ Compare the mapping throughputs written by _write_map_throughput
+        against the baseline.  A drop of more than tolerance (as a fraction of
+        the baseline) is a warning, or a failure if map_throughput_gate is fail """
+        if tolerance is None:
+            tolerance = self.map_throughput_tolerance
+        tp_path = os.path.join(self._outstore(tag), 'map_throughput.tsv')
+        if not os.path.isfile(tp_path):
+            return
+        with io.open(tp_path, 'r', encoding='utf8') as tp_file:
+            tp_dict = self._tsv_to_dict(tp_file.read())
+        try:
+            baseline_dict = self._tsv_to_dict(self._read_baseline_file(tag, 'map_throughput.tsv'))
+        except:
+            # Maybe there's no baseline file saved yet
+            baseline_dict = dict()
+
+        table = [['Method', 'Reads/s/core', 'Baseline Reads/s/core']]
+        for key in sorted(tp_dict.keys()):
+            table.append([key, round(tp_dict[key][0], 2),
+                          round(baseline_dict[key][0], 2) if key in baseline_dict else 'DNE'])
+        self._report_table(tag, 'map throughput', table)
+
+        regressed = []
+        for key, val in tp_dict.iteritems():
+            if key in baseline_dict and val[0] < baseline_dict[key][0] * (1. - tolerance):
+                msg = 'Map throughput of {} dropped to {} from {} reads/s/core'.format(
+                    key, round(val[0], 2), round(baseline_dict[key][0], 2))
+                log.warning(msg)
+                regressed.append(msg)
+        if self.map_throughput_gate == 'fail':
+            self.assertEqual(regressed, [])
+
+    def _score_index(self, tag, key, compare_against):
+        """ Get the ScoreIndex for the {key}.compare.{compare_against}.scores file
+        from mapeval in the outstore, parsing it only the first time it's asked for.
+        Returns None if there's no such file. """
+        # TODO: get this file's name/ID from the actual Toil code
+        score_path = os.path.join(self._outstore(tag), '{}.compare.{}.scores'.format(key, compare_against))
+        if score_path not in self.score_indexes:
+            self.score_indexes[score_path] = ScoreIndex(score_path) if os.path.isfile(score_path) else None
+        return self.score_indexes[score_path]
+
+    def _score_failed_mask(self, results, tag):
+        """ Get a mask over the rows of a PositionResults that are for reads
+        that fail the score check (get a worse score than on the primary graph) """
+        failed = np.zeros(len(results), dtype=bool)
+        for method in results.aligner_names:
+            # -se not currently in filenames. ugh. 
+            name = method[0:-3] if method.endswith('-se') else method
+            score_index = self._score_index(tag, name, 'primary')
+            if score_index is not None:
+                worse_hashes = score_index.worse_hashes()
+                if len(worse_hashes) > 0:
+                    method_rows = results.aligner_rows(method)
+                    failed[method_rows] = np.in1d(results.read_hashes()[method_rows], worse_hashes)
+        return failed
             
-    def _mapeval_r_plots(self, tag, positive_control=None, negative_control=None,
-                         control_include=['snp1kg', 'primary', 'common1kg'], min_reads_for_filter_plots=100):
-        """ Compute the mapeval r plots (ROC and QQ) """
+    def _mapeval_plots(self, tag, positive_control=None, negative_control=None,
+                       control_include=['snp1kg', 'primary', 'common1kg'], min_reads_for_filter_plots=100):
+        """ Compute the mapeval plots (PR, ROC and QQ) in the outstore """
         out_store = self._outstore(tag)
-        out_store_name = self._outstore_name(tag)
-        job_store = self._jobstore(tag)        
-
-        # What do we want to override from the default toil-vg config?
-        overrides = argparse.Namespace(
-            container = self.container,
-            # Toil options
-            realTimeLogging = True,
-            logLevel = "INFO",
-            maxCores = self.cores
-        )
 
         # Lookup names list with -pe and -se attached
         def pe_se(names):
             names_e = [[x, '{}-se'.format(x), '{}-pe'.format(x)] for x in names if x]
             return [y for x in names_e for y in x]
         
-        # Make the context
-        context = Context(out_store, overrides)
-        with context.get_toil(job_store) as toil:
-            try:
-                for rscript in ['pr', 'qq', 'roc']:
-                    # pull the scripts from where we expect them relative to being in vg/
-                    # and put them in the work directory.  This is ugly but keeps the
-                    # docker interfacing simple.
-                    shutil.copy2('scripts/plot-{}.R'.format(rscript), os.path.abspath(self.workdir))
-
-                    # if controls specified, filter into their own plot so things don't get too busy
-                    if positive_control or negative_control:
-                        nc_name = 'position.results.no.control.tsv'
-                        co_name = 'position.results.control.tsv'
-                        with io.open(os.path.join(out_store, 'position.results.tsv'), 'r', encoding='utf8') as pr_file,\
-                             io.open(os.path.join(out_store, nc_name), 'w', encoding='utf8') as nc_file,\
-                             io.open(os.path.join(out_store, co_name), 'w', encoding='utf8') as co_file:
-                            aidx = None
-                            for i, line in enumerate(pr_file):
-                                toks = line.rstrip().split()
-                                if i == 0:
-                                    aidx = toks.index('aligner')
-                                if i == 0 or toks[aidx].strip('"') in pe_se(control_include + 
-                                        [positive_control, negative_control]):
-                                    co_file.write(line)
-                                if i == 0 or toks[aidx].strip('"') not in  pe_se(
-                                        [positive_control, negative_control]):
-                                    nc_file.write(line)
-                    else:
-                        nc_name = 'position.results.tsv'
-                        co_name = None
-
-                    plot_names = [(nc_name, '')]
-                    if co_name:
-                        plot_names.append((co_name, '.control'))
-
-                    # make a plot where we ignore reads that fail score
-                    cur_plot_names = [pn for pn in plot_names]
-                    for name,tag in plot_names:
-                        pf_name = name.replace('.tsv', '.primary.filter.tsv')
-                        if self._filter_position_file(
-                                os.path.join(out_store, name),
-                                os.path.join(out_store, pf_name)) > min_reads_for_filter_plots:
-                            plot_names.append((pf_name, tag + '.primary.filter'))
-                        else:
-                            if os.path.isfile(os.path.join(out_store, pf_name)):
-                                os.remove(os.path.join(out_store, pf_name))
-                        
-                    for tsv_file, out_name in plot_names:
-                        cmd = ['Rscript', 'plot-{}.R'.format(rscript),
-                               os.path.join(out_store_name, tsv_file),
-                               os.path.join(out_store_name, '{}{}.svg'.format(rscript, out_name))]
-                        toil.start(Job.wrapJobFn(toil_call, context, cmd,
-                                                 work_dir = os.path.abspath(self.workdir)))
-
-                    os.remove(os.path.join(self.workdir, 'plot-{}.R'.format(rscript)))
-                    
-                if os.path.isfile(os.path.join(self.workdir, 'Rplots.pdf')):
-                    os.remove(os.path.join(self.workdir, 'Rplots.pdf'))
-
-            except Exception as e:
-                log.warning("Failed to generate ROC and QQ plots with Exception: {}".format(e))
-        
+        try:
+            # Load the position results once, and make every set of reads we
+            # want to plot as a mask over them.  A mask of None means all of them.
+            results = PositionResults(os.path.join(out_store, 'position.results.tsv'))
+            
+            # if controls specified, filter into their own plot so things don't get too busy
+            if positive_control or negative_control:
+                controls = pe_se([positive_control, negative_control])
+                plots = [('', ~results.aligner_in(controls)),
+                         ('.control', results.aligner_in(pe_se(control_include) + controls))]
+            else:
+                plots = [('', None)]
+
+            # make a plot where we ignore reads that fail score
+            failed = self._score_failed_mask(results, tag)
+            for plot_tag, mask in list(plots):
+                view_failed = failed if mask is None else failed & mask
+                if np.count_nonzero(view_failed) > min_reads_for_filter_plots:
+                    plots.append((plot_tag + '.primary.filter',
+                                  ~view_failed if mask is None else mask & ~view_failed))
+
+            for plot_tag, mask in plots:
+                rows = slice(None) if mask is None else mask
+                mapeval_plots.write_plots(results.aligners[rows], results.correct[rows],
+                                          results.mq[rows], out_store, plot_tag,
+                                          aligner_names=results.aligner_names)
+
+        except Exception as e:
+            log.warning("Failed to generate ROC and QQ plots with Exception: {}".format(e))
                         
     def _tsv_to_dict(self, stats, row_1 = 1):
         """ convert tsv string into dictionary """
@@ -707,7 +1323,10 @@ class VGCITest(TestCase):
         """
 
         # Make some plots in the outstore
-        self._mapeval_r_plots(tag, positive_control, negative_control)
+        self._mapeval_plots(tag, positive_control, negative_control)
+
+        # Check the map speed before the accuracy, so we see it either way
+        self._verify_map_throughput(tag)
 
         stats_path = os.path.join(self._outstore(tag), 'stats.tsv')
         with io.open(stats_path, 'r', encoding='utf8') as stats:
@@ -725,13 +1344,12 @@ class VGCITest(TestCase):
             table_name += ' (*: positive control)'
         if negative_control:
             table_name += ' (**: negative control)'
-        self._begin_message(table_name, is_tsv=True)
         
         # How many different columns do we want to see in the stats files?
         # We need to pad shorter rows with 0s
         stats_columns = 5 # read count, accuracy, AUC, QQ-plot r value, max F1
         
-        print '\t'.join(['Method', 'Acc.', 'Baseline Acc.', 'AUC', 'Baseline AUC', 'Max F1', 'Baseline F1'])
+        table = [['Method', 'Acc.', 'Baseline Acc.', 'AUC', 'Baseline AUC', 'Max F1', 'Baseline F1']]
         for key in sorted(set(baseline_dict.keys() + stats_dict.keys())):
             # What values do we have for the graph this run?
             sval = list(stats_dict.get(key, []))
@@ -768,8 +1386,8 @@ class VGCITest(TestCase):
                 row.append(stat_val)
                 row.append(baseline_val)
                                
-            print '\t'.join(row)
-        self._end_message()
+            table.append(row)
+        self._report_table(tag, table_name, table)
 
         # test the mapeval results, only looking at baseline keys
         for key, val in baseline_dict.iteritems():
@@ -831,22 +1449,14 @@ class VGCITest(TestCase):
                         # simulated from.
                         continue
                     
-                    # Guess where the file for individual read score differences for this graph is
-                    # TODO: get this file's name/ID from the actual Toil code
-                    read_comparison_path = os.path.join(self._outstore(tag), '{}.compare.{}.scores'.format(key, compare_against))
-                    for line in io.open(read_comparison_path, 'r', encoding='utf8'):
-                        if line.strip() == '':
-                            continue
-                        # Break each line of the CSV
-                        parts = line.split(', ')
-                        # Fields are read name, score difference, aligned score, baseline score
-                        read_name = parts[0]
-                        score_diff = int(parts[1])
-                        
-                        if score_diff < 0:
-                            # Complain about anyone who goes below 0.
-                            log.warning('Read {} has a negative score increase of {} on graph {} vs. {}'.format(
-                                read_name, score_diff, key, compare_against))
+                    # Check the individual read score differences for this graph
+                    score_index = self._score_index(tag, key, compare_against)
+                    self.assertIsNotNone(score_index, 'Missing read score comparison for {} vs. {}'.format(
+                        key, compare_against))
+                    for read_name, score_diff in score_index.worse_reads():
+                        # Complain about anyone who goes below 0.
+                        log.warning('Read {} has a negative score increase of {} on graph {} vs. {}'.format(
+                            read_name, score_diff, key, compare_against))
                 
                     if not baseline_dict.has_key(key):
                         # We might get new graphs that aren't in the baseline file.
@@ -910,6 +1520,7 @@ class VGCITest(TestCase):
         """
         assert not tag_ext or tag_ext.startswith('-')
         tag = 'sim-{}-{}{}'.format(region, baseline_graph, tag_ext)
+        self._clear_results(tag)
         
         # compute the xg indexes from scratch
         for graph in set([baseline_graph] + test_graphs):
@@ -1,30 +1,241 @@
+#!/usr/bin/env python
+"""
+Estimate the fragment length (insert size) distribution of paired reads.
+
+Reads a GAM (through vg view -a), the JSON alignment stream from vg view -a,
+or a file of one length per line, and reports the mean and SD (kept with
+Welford's online algorithm) along with the median, MAD, quantiles and the
+mean and SD of the lengths within --trim_mads MADs of the median, which are
+robust to the chimeric and discordant pairs that wreck the plain mean.
+
+Negative lengths count as their absolute values.  Lengths of 0 (which vg
+gives unpaired reads) are counted too, unless you ask for --drop_zero.
+
+Lengths are kept in a histogram of integer lengths, so the quantiles are exact
+in a memory footprint of one counter per distinct length.
+
+With --vectorize, input is processed in chunks of --chunk_size lines with
+NumPy, which is what you want on a 100M read GAM.
+
+run with::
+./bin/vg view -a alt.mega.gam | python scripts/calc_insert.py -
+or::
+python scripts/calc_insert.py --vectorize alt.mega.gam
+"""
+
 import sys
 import math
+import re
+import argparse
+import itertools
+import subprocess
+import collections
 
-# run with::
-# ./bin/vg view -a alt.mega.gam | grep -o "\"length\": [-]*[0-9]*" | cut -f 2 -d ":" | python scripts/calc_insert.py
+import numpy as np
 
-def calc_mean(vals):
-    return float(sum(vals)) / float(len(vals))
+# A decimal number, as float() reads it
+NUMBER = r'[-+]?(?:[0-9]+\.?[0-9]*|\.[0-9]+)(?:[eE][-+]?[0-9]+)?'
+# The fragment length in vg view -a JSON (edit lengths are from_length and
+# to_length, so they don't match)
+JSON_LENGTH_RE = re.compile(r'"length":\s*(' + NUMBER + ')')
+# A bare length on a line
+VALUE_RE = re.compile(r'^\s*(' + NUMBER + ')', re.M)
 
-def calc_sd(vals, mean):
-    sq_err_sum = 0.0
-    for i in vals:
-        sq_err_sum += (float(i) - mean) ** 2
+# Scales the MAD to estimate the SD of a normal distribution
+MAD_TO_SD = 1.4826
 
-    return  math.sqrt( (1.0 / float(len(vals))) * sq_err_sum)
+def parse_args(args):
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", nargs="?", default="-",
+        help="GAM, vg view -a JSON or one length per line (- for stdin)")
+    parser.add_argument("--format", choices=["gam", "json", "values"], default=None,
+        help="input format (default: gam for .gam files, otherwise guessed "
+        "from the first line)")
+    parser.add_argument("--vg", default="vg",
+        help="vg executable to view GAM input with")
+    parser.add_argument("--vectorize", action="store_true",
+        help="process the input in NumPy chunks")
+    parser.add_argument("--chunk_size", type=int, default=100000,
+        help="lines per chunk with --vectorize")
+    parser.add_argument("--report_every", type=int, default=0,
+        help="print the running mean and SD every this many lengths")
+    parser.add_argument("--trim_mads", type=float, default=5.0,
+        help="MADs from the median to keep for the trimmed mean and SD")
+    parser.add_argument("--drop_zero", action="store_true",
+        help="don't count lengths of 0 (unpaired reads)")
 
-if __name__ == "__main__":
+    args = args[1:]
+
+    return parser.parse_args(args)
+
+class RunningStats(object):
+    """
+    Count, mean and SD of a stream of numbers, updated one at a time with
+    Welford's algorithm, or a chunk at a time by combining the chunk's
+    moments with the running ones (Chan et al.)
+    """
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        # Sum of squared differences from the mean
+        self.m2 = 0.0
+
+    def add(self, x):
+        self.count += 1
+        delta = x - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (x - self.mean)
+
+    def add_array(self, values):
+        if len(values) == 0:
+            return
+        count = len(values)
+        mean = float(values.mean())
+        m2 = float(((values - mean) ** 2).sum())
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    def sd(self):
+        return math.sqrt(self.m2 / self.count) if self.count > 0 else float("nan")
+
+class LengthHistogram(object):
+    """
+    Counts of each integer length seen, for exact quantiles, MAD and trimmed
+    moments without keeping the lengths themselves
+    """
+    def __init__(self):
+        self.counts = collections.Counter()
+        self.total = 0
+
+    def add(self, x):
+        self.counts[int(round(x))] += 1
+        self.total += 1
+
+    def add_array(self, values):
+        lengths, counts = np.unique(np.rint(values).astype(np.int64), return_counts=True)
+        for length, count in itertools.izip(lengths.tolist(), counts.tolist()):
+            self.counts[length] += count
+        self.total += len(values)
 
-    vals = []
-    for line in sys.stdin:
-        x = float(line.strip())
-        if x > 0:
-            vals.append(x);
-        else:
-            vals.append(-1.0 * x)
-        if len(vals) == 1000:
-            mean = calc_mean(vals)
-            sd = calc_sd(vals, mean)
-            print "Mean: ", mean, ",  SD: ", sd
-            del vals[:]
+    def quantile(self, q, counts=None):
+        """ Get the smallest length with at least fraction q of the lengths at
+        or below it """
+        counts = counts if counts is not None else self.counts
+        total = sum(counts.itervalues())
+        seen = 0
+        for length in sorted(counts):
+            seen += counts[length]
+            if seen >= q * total:
+                return length
+        return float("nan")
+
+    def median(self):
+        return self.quantile(0.5)
+
+    def mad(self):
+        """ Get the median absolute deviation from the median """
+        median = self.median()
+        deviations = collections.Counter()
+        for length, count in self.counts.iteritems():
+            deviations[abs(length - median)] += count
+        return self.quantile(0.5, deviations)
+
+    def trimmed_stats(self, low, high):
+        """ Get the RunningStats of the lengths in [low, high] """
+        stats = RunningStats()
+        if self.total == 0:
+            return stats
+        lengths = np.array([l for l in self.counts if low <= l <= high], dtype=np.float64)
+        if len(lengths) == 0:
+            return stats
+        weights = np.array([self.counts[l] for l in lengths.astype(np.int64).tolist()],
+                           dtype=np.float64)
+        stats.count = int(weights.sum())
+        stats.mean = float((lengths * weights).sum() / weights.sum())
+        stats.m2 = float((weights * (lengths - stats.mean) ** 2).sum())
+        return stats
+
+def open_input(options):
+    """ Get a line iterator over the input text, and its format """
+    fmt = options.format
+    if fmt is None and options.input.endswith(".gam"):
+        fmt = "gam"
+    if fmt == "gam":
+        process = subprocess.Popen([options.vg, "view", "-a", options.input],
+                                   stdout=subprocess.PIPE)
+        lines = process.stdout
+        fmt = "json"
+    else:
+        lines = sys.stdin if options.input == "-" else open(options.input, "r")
+    if fmt is None:
+        # guess from the first line
+        first = next(lines, "")
+        fmt = "json" if first.lstrip().startswith("{") else "values"
+        lines = itertools.chain([first], lines)
+    return lines, fmt
+
+def iter_chunks(lines, chunk_size):
+    """ Yield lists of up to chunk_size lines """
+    while True:
+        chunk = list(itertools.islice(lines, chunk_size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+def report(stats):
+    print "Mean: ", stats.mean, ",  SD: ", stats.sd()
+
+def summarize(stats, hist, trim_mads):
+    median = hist.median()
+    mad = hist.mad()
+    trimmed = hist.trimmed_stats(median - trim_mads * mad * MAD_TO_SD,
+                                 median + trim_mads * mad * MAD_TO_SD)
+    print "Count: ", stats.count
+    print "Mean: ", stats.mean, ",  SD: ", stats.sd()
+    print "Median: ", median, ",  MAD: ", mad, ",  MAD SD: ", mad * MAD_TO_SD
+    print "Quantiles (1%, 5%, 25%, 75%, 95%, 99%): ", ", ".join(
+        str(hist.quantile(q)) for q in [0.01, 0.05, 0.25, 0.75, 0.95, 0.99])
+    print "Trimmed ({} MADs) Count: ".format(trim_mads), trimmed.count, \
+        ",  Mean: ", trimmed.mean, ",  SD: ", trimmed.sd()
+
+def main(args):
+    options = parse_args(args)
+
+    lines, fmt = open_input(options)
+    regex = JSON_LENGTH_RE if fmt == "json" else VALUE_RE
+
+    stats = RunningStats()
+    hist = LengthHistogram()
+    next_report = options.report_every
+
+    if options.vectorize:
+        for chunk in iter_chunks(lines, options.chunk_size):
+            values = np.abs(np.array(regex.findall("".join(chunk)), dtype=np.float64))
+            if options.drop_zero:
+                values = values[values != 0]
+            stats.add_array(values)
+            hist.add_array(values)
+            if options.report_every and stats.count >= next_report:
+                report(stats)
+                next_report = (stats.count // options.report_every + 1) * options.report_every
+    else:
+        for line in lines:
+            for token in regex.findall(line):
+                x = abs(float(token))
+                if x == 0 and options.drop_zero:
+                    continue
+                stats.add(x)
+                hist.add(x)
+                if options.report_every and stats.count % options.report_every == 0:
+                    report(stats)
+
+    summarize(stats, hist, options.trim_mads)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -10,8 +10,9 @@ genuine instance of the variant.
 
 This script removes such variants from VCFs.
 
-Repeat count information is pulled from the hgsql command, which must be
-available.
+Repeat information is pulled from the rmsk table with the hgsql command, or
+from a UCSC rmsk.txt.gz dump, and imported once into a local index that later
+runs reuse without a database connection.
 
 """
 
@@ -21,11 +22,16 @@ import sys
 import time
 import subprocess
 import collections
+import array
+import gzip
+import itertools
+import multiprocessing
+import shutil
+import tempfile
 
+import numpy as np
 import vcf
 import tsv
-from intervaltree import IntervalTree
-import itertools
 
 def parse_args(args):
     """
@@ -52,6 +58,22 @@ def parse_args(args):
         help="VCF file to write passing entries to")
     parser.add_argument("--assembly", default="hg38",
         help="assembly database name to query")
+    parser.add_argument("--repeat_index", default=None,
+        help="directory to keep the imported repeats in (default: "
+        "<assembly>.rmsk)")
+    parser.add_argument("--rmsk", default=None,
+        help="import repeats from this UCSC rmsk.txt(.gz) instead of hgsql")
+    parser.add_argument("--batch_size", type=int, default=10000,
+        help="number of variants to look up repeats for at once")
+    parser.add_argument("--whole_genome", action="store_true",
+        help="filter every contig in the (indexed) VCF instead of one range")
+    parser.add_argument("--region_size", type=int, default=None,
+        help="with --whole_genome, split contigs into regions this long")
+    parser.add_argument("--threads", type=int,
+        default=multiprocessing.cpu_count(),
+        help="with --whole_genome, number of processes to filter with")
+    parser.add_argument("--verbose", action="store_true",
+        help="log the decision for every variant")
     parser.add_argument("--contig", default="chr17",
         help="contig to pull variants from")
     parser.add_argument("--start", type=int, default=43044294,
@@ -67,39 +89,164 @@ def parse_args(args):
         
     return parser.parse_args(args)
 
-class RepeatDb(object):
+# Repeats are stored as records of these fields, sorted by start
+INTERVAL_DTYPE = np.dtype([("start", np.int64), ("end", np.int64),
+    ("name", np.int32)])
 
-    def __init__(self, assembly, contig, start, end):
+class RepeatIndex(object):
+    """
+    On-disk index of all the repeats in an assembly's rmsk table.
+    
+    Each contig's repeats are kept as a .npy array of (start, end, name ID)
+    records sorted by start, which is memory-mapped when loaded, so only the
+    contigs and pages we actually query are read. Repeat names are in
+    names.txt, one per ID, and the contigs with their repeat counts are in
+    contigs.tsv.
+    
+    """
+    
+    def __init__(self, index_dir):
+        """
+        Load the index from the given directory, which must already have been
+        made with build().
         """
-        Given a range on a contig, get all the repeats overlapping that range.
-        
-        Keeps an IntervalTree of element names, and a Counter from element
-        name to number of that element in the range.
         
-        No protection against SQL injection.
+        self.index_dir = index_dir
         
+        with open(os.path.join(index_dir, "names.txt")) as names_file:
+            self.names = [line.rstrip("\n") for line in names_file]
+            
+        # Map from contig name to number of repeats on it
+        self.contigs = {}
+        for parts in tsv.TsvReader(open(os.path.join(index_dir, "contigs.tsv"))):
+            self.contigs[parts[0]] = int(parts[1])
+            
+    def intervals(self, contig):
+        """
+        Get the sorted array of repeats on the given contig, which may be
+        empty.
         """
         
-        # Make the interval tree
-        self.tree = IntervalTree()
-        
-        # Make a counter for repeats with a certain name
-        self.counts = collections.Counter()
+        if contig not in self.contigs:
+            return np.zeros(0, dtype=INTERVAL_DTYPE)
+        return np.load(os.path.join(self.index_dir, contig + ".npy"),
+            mmap_mode="r")
+            
+    @staticmethod
+    def build(index_dir, rows):
+        """
+        Make an index in index_dir from an iterable of (contig, start, end,
+        repeat name) tuples. The index is written beside index_dir and then
+        moved into place, so a half-built index is never loaded.
+        """
         
-        command = ["hgsql", "-e", "select repName, genoName, genoStart, genoEnd "
-            "from {}.rmsk where genoName = '{}' and genoStart > '{}' "
-            "and genoEnd < '{}';".format(assembly, contig, start, end)]
-        process = subprocess.Popen(command, stdout=subprocess.PIPE)
+        # Map from repeat name to ID
+        name_ids = {}
+        # Map from contig to arrays of starts, ends, and name IDs, which are
+        # much smaller than lists for the millions of repeats in a genome
+        columns = collections.defaultdict(lambda: (array.array("l"),
+            array.array("l"), array.array("i")))
         
-        for parts in itertools.islice(tsv.TsvReader(process.stdout), 1, None):
-            # For each line except the first, broken into fields
+        for contig, start, end, name in rows:
+            starts, ends, names = columns[contig]
+            starts.append(start)
+            ends.append(end)
+            names.append(name_ids.setdefault(name, len(name_ids)))
             
-            # Add the item to the tree covering its range. Store the repeat type
-            # name as the interval's data.
-            self.tree.addi(int(parts[2]), int(parts[3]), parts[0])
+        build_dir = index_dir + ".building"
+        if not os.path.exists(build_dir):
+            os.makedirs(build_dir)
             
-            # Count it
-            self.counts[parts[0]] += 1
+        with open(os.path.join(build_dir, "contigs.tsv"), "w") as contigs_file:
+            for contig, (starts, ends, names) in sorted(columns.items()):
+                intervals = np.zeros(len(starts), dtype=INTERVAL_DTYPE)
+                intervals["start"] = np.frombuffer(starts, dtype=np.dtype("l"))
+                intervals["end"] = np.frombuffer(ends, dtype=np.dtype("l"))
+                intervals["name"] = np.frombuffer(names, dtype=np.dtype("i"))
+                intervals = intervals[np.argsort(intervals["start"],
+                    kind="mergesort")]
+                np.save(os.path.join(build_dir, contig + ".npy"), intervals)
+                contigs_file.write("{}\t{}\n".format(contig, len(intervals)))
+                
+        with open(os.path.join(build_dir, "names.txt"), "w") as names_file:
+            for name, _ in sorted(name_ids.items(), key=lambda item: item[1]):
+                names_file.write(name + "\n")
+                
+        os.rename(build_dir, index_dir)
+
+def rmsk_rows(assembly, rmsk_path=None):
+    """
+    Yield (contig, start, end, repeat name) for every repeat in the given
+    assembly. Reads the given UCSC rmsk.txt(.gz) dump if any, and otherwise
+    queries the rmsk table with hgsql, which must be available.
+    
+    No protection against SQL injection.
+    
+    """
+    
+    if rmsk_path is not None:
+        rmsk_file = (gzip.open(rmsk_path) if rmsk_path.endswith(".gz")
+            else open(rmsk_path))
+        for line in rmsk_file:
+            # The dump has bin, swScore, milliDiv, milliDel, milliIns,
+            # genoName, genoStart, genoEnd, genoLeft, strand, repName, ...
+            parts = line.split("\t")
+            yield parts[5], int(parts[6]), int(parts[7]), parts[10]
+        return
+        
+    command = ["hgsql", "-e", "select genoName, genoStart, genoEnd, repName "
+        "from {}.rmsk;".format(assembly)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    
+    for parts in itertools.islice(tsv.TsvReader(process.stdout), 1, None):
+        # For each line except the first, broken into fields
+        yield parts[0], int(parts[1]), int(parts[2]), parts[3]
+        
+    if process.wait() != 0:
+        raise RuntimeError("Could not query {}.rmsk".format(assembly))
+
+def load_repeat_index(index_dir, assembly, rmsk_path=None):
+    """
+    Load the repeat index from index_dir, importing the assembly's repeats
+    into it first if it isn't there yet.
+    """
+    
+    if not os.path.exists(os.path.join(index_dir, "contigs.tsv")):
+        sys.stderr.write("Importing {} repeats to {}\n".format(assembly,
+            index_dir))
+        RepeatIndex.build(index_dir, rmsk_rows(assembly, rmsk_path))
+    return RepeatIndex(index_dir)
+
+class RepeatDb(object):
+
+    def __init__(self, index, contig, start=None, end=None):
+        """
+        Given a RepeatIndex and a contig, and optionally a range on it, get
+        all the repeats on the contig (or contained in the range).
+        
+        Keeps the repeats' starts and ends, sorted by start, and the number of
+        repeats on the contig (or in the range) with the same name as each.
+        
+        """
+        
+        self.contig = contig
+        
+        intervals = index.intervals(contig)
+        if start is not None and end is not None:
+            # Only look at repeats inside the range
+            intervals = intervals[(intervals["start"] > start) &
+                (intervals["end"] < end)]
+                
+        self.starts = intervals["start"]
+        self.ends = intervals["end"]
+        
+        # Count repeats with each name, and give each repeat its count
+        names = np.asarray(intervals["name"])
+        self.copies = np.bincount(names, minlength=len(index.names))[names]
+        
+        # Any repeat covering a position starts at most this far before it
+        self.max_length = (int((self.ends - self.starts).max())
+            if len(intervals) > 0 else 0)
 
     def get_copies(self, contig, pos):
         """
@@ -109,60 +256,100 @@ class RepeatDb(object):
         Return the number of instances expected (1 for non-repetitive sequence).
         """
         
-        # TODO: use contig
+        return int(self.get_copies_batch(contig, np.array([pos]))[0])
         
-        # Get the set of overlapping things
-        overlaps = self.tree[pos]
+    def get_copies_batch(self, contig, positions):
+        """
+        Given a contig name and an array of positions on it, estimate the copy
+        number of each position, as the number of copies of the most numerous
+        repeat it is in (or 1 for non-repetitive sequence).
         
-        # Keep track of the number of copies of the most numerous repeat
-        # observed.
-        max_copies = 1
+        Works as a sweep over the sorted positions and the repeats that could
+        overlap them.
+        """
         
-        for interval in overlaps:
-            # For each repeat we are in
-            
-            # Max in how many copies of it exist
-            max_copies = max(max_copies, self.counts[interval.data])
+        positions = np.asarray(positions, dtype=np.int64)
+        # Sort the positions, remembering where they came from
+        order = np.argsort(positions, kind="mergesort")
+        sorted_positions = positions[order]
+        copies = np.ones(len(positions), dtype=np.int64)
+        
+        if (contig != self.contig or len(positions) == 0 or
+            len(self.starts) == 0):
+            return copies
             
-        return max_copies
+        # Get the repeats that start close enough before the positions to
+        # cover any of them
+        first = np.searchsorted(self.starts,
+            sorted_positions[0] - self.max_length, side="right")
+        last = np.searchsorted(self.starts, sorted_positions[-1], side="right")
+        
+        # Find the run of sorted positions each repeat covers. Repeats are
+        # half-open [start, end) intervals.
+        low = np.searchsorted(sorted_positions, self.starts[first:last],
+            side="left")
+        high = np.searchsorted(sorted_positions, self.ends[first:last],
+            side="left")
+        counts = high - low
+        covering = counts > 0
+        low = low[covering]
+        counts = counts[covering]
+        repeat_copies = self.copies[first:last][covering]
+        
+        # Expand to a (position, copies) pair for each repeat covering each
+        # position, and max the copies in
+        run_starts = np.cumsum(counts) - counts
+        covered = (np.repeat(low - run_starts, counts) +
+            np.arange(counts.sum()))
+        np.maximum.at(copies, covered, np.repeat(repeat_copies, counts))
+        
+        # Put the answers back in the order the positions came in
+        result = np.empty_like(copies)
+        result[order] = copies
+        return result
             
-   
-def main(args):
+def batch_copies(db, variants, batch_size):
     """
-    Parses command line arguments and do the work of the program.
-    "args" specifies the program arguments, with args[0] being the executable
-    name. The return value should be used as the program's exit code.
+    Given a RepeatDb and an iterable of VCF records, yield each record with
+    its estimated copy number, looking the copy numbers up a batch at a time.
     """
     
-    options = parse_args(args) # This holds the nicely-parsed options object
-    
-    # Make a repeat database
-    db = RepeatDb(options.assembly, options.contig, options.start, options.end)
-    
-    # Strip "chr" from the contig.
-    # TODO: figure out if we need to
-    short_contig = (options.contig[3:] if len(options.contig) > 3
-        else options.contig)
-    
-    # Read the input VCF
-    reader = vcf.Reader(options.vcf)
-    
-    # Make a writer for the passing records
-    writer = vcf.Writer(options.out_vcf, reader)
+    variants = iter(variants)
+    while True:
+        batch = list(itertools.islice(variants, batch_size))
+        if len(batch) == 0:
+            return
+        
+        # Look up each contig's variants together
+        copies = np.ones(len(batch), dtype=np.int64)
+        by_contig = collections.defaultdict(list)
+        for i, variant in enumerate(batch):
+            by_contig[variant.CHROM].append(i)
+        for contig, indexes in by_contig.iteritems():
+            copies[indexes] = db.get_copies_batch("chr" + contig,
+                [batch[i].POS for i in indexes])
+                
+        for variant, count in itertools.izip(batch, copies.tolist()):
+            yield variant, count
+   
+def filter_records(db, variants, error_rate, batch_size, counts,
+    verbose=False):
+    """
+    Given a RepeatDb and an iterable of VCF records, yield the records to keep.
     
-    # Track statistics
-    total_variants = 0
-    kept_variants = 0
-    non_snp_variants = 0
+    Tallies the variants seen ("total"), kept ("kept"), not modeled because
+    they are not SNPs ("non_snp"), on repeats ("repeat") and dropped
+    ("dropped") in the given Counter. If verbose is set, also logs each
+    variant's decision to standard error.
+    """
     
-    for variant in reader.fetch(short_contig, options.start, options.end):
-        # For each variant in our region
+    for variant, count in batch_copies(db, variants, batch_size):
+        # For each variant, with how numerous it should be
         
         # Count it
-        total_variants += 1
-        
-        # See how numerous it should be
-        count = db.get_copies("chr" + variant.CHROM, variant.POS)
+        counts["total"] += 1
+        if count > 1:
+            counts["repeat"] += 1
         
         # And how common it is
         frequency = variant.INFO["AF"][0]
@@ -171,35 +358,189 @@ def main(args):
             # SNPs are modeled
         
             # What's the minimum frequency to get more true than fake hits?
-            min_frequency = (count * options.error_rate /
-                (3 - 2 * options.error_rate))
+            min_frequency = (count * error_rate / (3 - 2 * error_rate))
                 
             # Should we keep it?
             keep = (frequency >= min_frequency)
             
-            sys.stderr.write(
-                "{} {}:{} has {} copies, frequency {:.4f} vs. {:.4f}\n".format(
-                "☑" if keep else "☐", variant.CHROM, variant.POS, count,
-                frequency, min_frequency))
+            if verbose:
+                sys.stderr.write(
+                    "{} {}:{} has {} copies, frequency {:.4f} vs. {:.4f}\n".format(
+                    "☑" if keep else "☐", variant.CHROM, variant.POS, count,
+                    frequency, min_frequency))
         else:
             # We have to keep everything that's not a SNP because we have no
             # error model
             
             keep = True
-            sys.stderr.write(
-                "{} {}:{} has {} copies, frequency {:.4f} (non-SNP)\n".format(
-                "☑" if keep else "☐", variant.CHROM, variant.POS, count,
-                frequency))
-            non_snp_variants += 1
+            if verbose:
+                sys.stderr.write(
+                    "{} {}:{} has {} copies, frequency {:.4f} (non-SNP)\n".format(
+                    "☑" if keep else "☐", variant.CHROM, variant.POS, count,
+                    frequency))
+            counts["non_snp"] += 1
             
         if keep:
             # Pass the variants we're keeping
+            counts["kept"] += 1
+            yield variant
+        else:
+            counts["dropped"] += 1
+
+def genome_shards(vcf_path, region_size=None):
+    """
+    Yield (contig, start, end) shards covering all the contigs with variants
+    in the given indexed VCF, in index order. Contigs are split into regions
+    of region_size bases if their lengths are in the VCF header, and otherwise
+    have start and end of None.
+    """
+    
+    # pysam is what vcf uses to fetch, so it must be there.
+    import pysam
+    
+    lengths = {}
+    if region_size:
+        for contig in vcf.Reader(filename=vcf_path).contigs.itervalues():
+            lengths[contig.id] = contig.length
+    
+    for contig in pysam.TabixFile(vcf_path).contigs:
+        length = lengths.get(contig)
+        if region_size and length:
+            for start in xrange(0, length, region_size):
+                yield contig, start, min(start + region_size, length)
+        else:
+            yield contig, None, None
+
+def filter_shard(job):
+    """
+    Filter one shard of a VCF in a worker process, writing the kept records
+    (after a header) to the job's output path.
+    
+    Takes a tuple of the VCF path, contig, start and end (0-based, half-open,
+    or None for the whole contig), repeat index directory, error rate, batch
+    size, output path and verbose flag, so it can be mapped over by a Pool. Returns the
+    output path and a Counter of the variants seen, as filter_records counts
+    them.
+    """
+    
+    vcf_path, contig, start, end, index_dir, error_rate, batch_size, \
+        out_path, verbose = job
+    
+    # Each worker gets just its own contig's repeats, which are counted over
+    # the whole contig so regions don't change the answers.
+    db = RepeatDb(RepeatIndex(index_dir), "chr" + contig)
+    
+    reader = vcf.Reader(filename=vcf_path)
+    variants = reader.fetch(contig, start, end)
+    if start is not None:
+        # Fetching gets everything overlapping the region, so drop variants
+        # that belong to the shard before.
+        variants = (variant for variant in variants
+            if start < variant.POS <= end)
+    
+    counts = collections.Counter()
+    with open(out_path, "w") as out_file:
+        writer = vcf.Writer(out_file, reader)
+        for variant in filter_records(db, variants, error_rate, batch_size,
+            counts, verbose):
+            writer.write_record(variant)
+        writer.flush()
+        
+    return out_path, counts
+
+def filter_genome(options, index_dir):
+    """
+    Filter all the variants in the VCF, in shards over a pool of processes,
+    and concatenate the shards in order to the output VCF. Returns a Counter
+    of the variants seen, as filter_records counts them.
+    """
+    
+    vcf_path = options.vcf.name
+    if not os.path.isfile(vcf_path):
+        raise RuntimeError("Whole genome filtering needs an indexed VCF file, "
+            "not {}".format(vcf_path))
+    
+    # Write the header ourselves, and then just the records from the shards
+    writer = vcf.Writer(options.out_vcf, vcf.Reader(filename=vcf_path))
+    writer.flush()
+    
+    shard_dir = tempfile.mkdtemp(prefix="filter_variants_on_repeats")
+    jobs = [(vcf_path, contig, start, end, index_dir, options.error_rate,
+        options.batch_size, os.path.join(shard_dir, "{}.vcf".format(i)),
+        options.verbose)
+        for i, (contig, start, end) in enumerate(genome_shards(vcf_path,
+        options.region_size))]
+    
+    counts = collections.Counter()
+    pool = multiprocessing.Pool(options.threads)
+    try:
+        for i, (out_path, shard_counts) in enumerate(pool.imap(filter_shard,
+            jobs)):
+            # Shards come back in order, so we can stream them out as they
+            # finish
+            with open(out_path) as shard_file:
+                for line in shard_file:
+                    if not line.startswith("#"):
+                        options.out_vcf.write(line)
+            os.unlink(out_path)
+            counts.update(shard_counts)
+            
+            contig, start, end = jobs[i][1:4]
+            sys.stderr.write("Shard {}/{} {}{}: kept {} / {} variants\n".format(
+                i + 1, len(jobs), contig,
+                ":{}-{}".format(start + 1, end) if start is not None else "",
+                shard_counts["kept"], shard_counts["total"]))
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        shutil.rmtree(shard_dir)
+        
+    return counts
+   
+def main(args):
+    """
+    Parses command line arguments and do the work of the program.
+    "args" specifies the program arguments, with args[0] being the executable
+    name. The return value should be used as the program's exit code.
+    """
+    
+    options = parse_args(args) # This holds the nicely-parsed options object
+    
+    # Make sure we have a repeat database before any workers want it
+    index_dir = (options.repeat_index or
+        "{}.rmsk".format(options.assembly))
+    index = load_repeat_index(index_dir, options.assembly, options.rmsk)
+    
+    if options.whole_genome:
+        counts = filter_genome(options, index_dir)
+    else:
+        db = RepeatDb(index, options.contig, options.start, options.end)
+        
+        # Strip "chr" from the contig.
+        # TODO: figure out if we need to
+        short_contig = (options.contig[3:] if len(options.contig) > 3
+            else options.contig)
+        
+        # Read the input VCF
+        reader = vcf.Reader(options.vcf)
+        
+        # Make a writer for the passing records
+        writer = vcf.Writer(options.out_vcf, reader)
+        
+        # Track statistics
+        counts = collections.Counter()
+        
+        for variant in filter_records(db,
+            reader.fetch(short_contig, options.start, options.end),
+            options.error_rate, options.batch_size, counts, options.verbose):
+            # For each variant in our region that we keep, pass it
             writer.write_record(variant)
-            # Count it
-            kept_variants += 1
             
-    sys.stderr.write("Finished! Kept {} ({} non-SNP) / {} variants\n".format(
-        kept_variants, non_snp_variants, total_variants))
+    sys.stderr.write("Finished! Kept {} ({} non-SNP) / {} variants, dropped "
+        "{} SNPs, {} variants on repeats\n".format(counts["kept"],
+        counts["non_snp"], counts["total"], counts["dropped"],
+        counts["repeat"]))
         
     
     return 0
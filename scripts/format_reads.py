@@ -1,5 +1,8 @@
 import sys
+import gzip
 import argparse
+import itertools
+import subprocess
 
 
 class FQRecord:
@@ -22,32 +25,192 @@ pseudo fastq from it"""
 def make_fastq(record, name, fake_qual, seq="", anno=""):
     if record.name == "":
         record.name = name
-    
-    record.qual = "".join([fake_qual for i in xrange(0, len(record.seq))])
+
+    record.qual = fake_qual * len(record.seq)
 
     return record
 
+
+class QualityCache(dict):
+    """Fake quality strings by read length, so each length
+    is only built once"""
+    def __init__(self, fake_qual):
+        self.fake_qual = fake_qual
+
+    def __missing__(self, length):
+        qual = self[length] = self.fake_qual * length
+        return qual
+
+
+"""Opens path (- for stdout) for writing, through gzip, pigz or
+bgzip as asked. Returns the stream to write to, a list of
+subprocesses to wait on after closing it, and the underlying
+file, to close after those"""
+def open_output(path, compress=None, threads=1):
+    out = sys.stdout if path == "-" else open(path, "wb")
+    if compress is None:
+        return out, [], out
+    if compress == "bgzf":
+        # -i writes a .gzi index, so the uncompressed offsets in
+        # our index work with bgzip -b
+        cmd = ["bgzip", "-c", "-@", str(threads)]
+        if path != "-":
+            cmd += ["-i", "-I", path + ".gzi"]
+    elif threads > 1:
+        cmd = ["pigz", "-c", "-p", str(threads)]
+    else:
+        return gzip.GzipFile(fileobj=out, mode="wb"), [], out
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=out)
+    return proc.stdin, [proc], out
+
+
+class FastqWriter:
+    """Writes blocks of reads as FASTQ with buffered writelines. Can
+    also record the uncompressed byte offset of every index_every'th
+    record, as read number, name and offset"""
+    def __init__(self, path="-", fake_qual="I", compress=None, threads=1,
+                 index_path=None, index_every=1000):
+        self.out, self.procs, self.target = open_output(path, compress, threads)
+        self.path = path
+        self.quals = QualityCache(fake_qual)
+        self.index = open(index_path, "w") if index_path else None
+        self.index_every = index_every
+        self.count = 0
+        self.offset = 0
+
+    def write_block(self, names, seqs):
+        lines = []
+        quals = self.quals
+        for name, seq in zip(names, seqs):
+            record = "@%s\n%s\n+\n%s\n" % (name, seq, quals[len(seq)])
+            if self.index is not None:
+                if self.count % self.index_every == 0:
+                    self.index.write("{}\t{}\t{}\n".format(self.count, name, self.offset))
+                self.offset += len(record)
+            lines.append(record)
+            self.count += 1
+        self.out.writelines(lines)
+
+    def close(self):
+        if self.out is not sys.stdout:
+            self.out.close()
+        # Wait for any compressor to finish before closing its output
+        failed = [proc for proc in self.procs if proc.wait() != 0]
+        if self.target is not sys.stdout and self.target is not self.out:
+            self.target.close()
+        if self.index is not None:
+            self.index.close()
+        if failed:
+            raise RuntimeError("Compressing {} failed with status {}".format(
+                self.path, failed[0].returncode))
+
+
+"""Reads blocks of about block_bytes from the file, as
+lists of sequences"""
+def read_blocks(fi, block_bytes):
+    while True:
+        lines = fi.readlines(block_bytes)
+        if not lines:
+            return
+        yield [line.strip() for line in lines]
+
+
+"""Lazily zips blocks of mate 1 sequences from fi1 with the same
+number of mate 2 sequences from fi2, as interleaved lists"""
+def read_paired_blocks(fi1, fi2, block_bytes):
+    for seqs1 in read_blocks(fi1, block_bytes):
+        seqs2 = [line.strip() for line in itertools.islice(fi2, len(seqs1))]
+        if len(seqs2) != len(seqs1):
+            raise RuntimeError("Mate 2 input has fewer reads than mate 1")
+        seqs = [None] * (2 * len(seqs1))
+        seqs[0::2] = seqs1
+        seqs[1::2] = seqs2
+        yield seqs
+    if next(fi2, None) is not None:
+        raise RuntimeError("Mate 2 input has more reads than mate 1")
+
+
+"""Reads blocks of interleaved mates (as vg sim -i writes them),
+keeping pairs together"""
+def read_interleaved_blocks(fi, block_bytes):
+    for seqs in read_blocks(fi, block_bytes):
+        if len(seqs) % 2 == 1:
+            mate = fi.readline()
+            if not mate:
+                raise RuntimeError("Interleaved input has an unpaired read")
+            seqs.append(mate.strip())
+        yield seqs
+
+
+"""Gets the path of shard i of n, as foo.i.fq.gz for foo.fq.gz"""
+def shard_path(path, i, n):
+    if path is None or n == 1:
+        return path
+    if path == "-":
+        raise RuntimeError("Can't write shards to stdout")
+    for ext in [".fastq", ".fq"]:
+        if ext in path:
+            at = path.index(ext)
+            return "{}.{}{}".format(path[:at], i, path[at:])
+    return "{}.{}".format(path, i)
+
+
 def parse_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument("-i", dest="infile", type=str, required=True)
+    parser.add_argument("-i", dest="infile", type=str, required=True,
+                        help="file of one read sequence per line (- for stdin)")
     parser.add_argument("-n", dest="namebase", type=str, required=True)
     parser.add_argument("-q", dest="qual", type=str, required=True)
+    parser.add_argument("-o", dest="outfile", type=str, default="-",
+                        help="FASTQ to write (default stdout)")
+    parser.add_argument("-z", dest="compress", choices=["gzip", "bgzf"], default=None,
+                        help="compress the output")
+    parser.add_argument("-t", dest="threads", type=int, default=1,
+                        help="compression threads (uses pigz for gzip)")
+    parser.add_argument("-x", dest="index", type=str, default=None,
+                        help="write an index of read number, name and "
+                        "uncompressed byte offset to this file")
+    parser.add_argument("--index-every", dest="index_every", type=int, default=1000,
+                        help="index every this many reads")
+    parser.add_argument("--block-bytes", dest="block_bytes", type=int, default=1 << 22,
+                        help="input to read at a time")
+    parser.add_argument("-2", dest="mate_file", type=str, default=None,
+                        help="file of mate 2 sequences, paired in order with -i; "
+                        "output is interleaved")
+    parser.add_argument("-p", dest="interleaved", action="store_true",
+                        help="-i holds interleaved mates; output is interleaved")
+    parser.add_argument("-s", dest="shards", type=int, default=1,
+                        help="deal blocks of reads round-robin to this many "
+                        "output files, numbered before the .fq extension")
     return parser.parse_args()
-    
+
 
 if __name__ == "__main__":
     ## Add the sample name to the front of the
     ## read line.
     args = parse_args()
-    readfile = args.infile
     name_base = args.namebase
-    fake_qual = args.qual
+    paired = args.mate_file is not None or args.interleaved
+    writers = [FastqWriter(shard_path(args.outfile, i, args.shards), args.qual,
+                           args.compress, args.threads,
+                           shard_path(args.index, i, args.shards), args.index_every)
+               for i in xrange(args.shards)]
+    fi = sys.stdin if args.infile == "-" else open(args.infile, "r")
+    if args.mate_file is not None:
+        blocks = read_paired_blocks(fi, open(args.mate_file, "r"), args.block_bytes)
+    elif args.interleaved:
+        blocks = read_interleaved_blocks(fi, args.block_bytes)
+    else:
+        blocks = read_blocks(fi, args.block_bytes)
     count = 0
-    with open(readfile, "r") as fi:
-        for line in fi:
-            record = FQRecord()
-            record.seq = line.strip()
-            record.name = name_base + "_" + str(count)
-            record = make_fastq(record, "", fake_qual)
-            print record.string()
-            count += 1
+    for block, seqs in enumerate(blocks):
+        if paired:
+            names = [name_base + "_" + str(count + i // 2) + ("/1", "/2")[i % 2]
+                     for i in xrange(len(seqs))]
+            count += len(seqs) // 2
+        else:
+            names = [name_base + "_" + str(i) for i in xrange(count, count + len(seqs))]
+            count += len(seqs)
+        writers[block % args.shards].write_block(names, seqs)
+    for writer in writers:
+        writer.close()
@@ -4,30 +4,142 @@
 
 # length.bp       unaligned.bp    known.nodes     known.bp        novel.nodes     novel.bp
 
+### reads stdin in blocks, and tests positions against any number of thresholds at once.
+### with several thresholds, each read gets a correct column per threshold. --table writes
+### counts of correct, incorrect and failed reads per threshold and MAPQ bin, accumulated
+### from the highest MAPQ down as well, which is what the ROC/PR plots are made from.
+
 import sys
+import argparse
+import itertools
+
+import numpy as np
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description="Tag simulated read alignments as correct "
+                                     "if within threshold bp of their true positions")
+    parser.add_argument("thresholds", type=int, nargs="+",
+                        help="max distance from the true position for a correct alignment")
+    parser.add_argument("--table", default=None,
+                        help="write a confusion table per threshold and MAPQ bin here")
+    parser.add_argument("--bin_width", type=int, default=1,
+                        help="MAPQ bin width for the table")
+    parser.add_argument("--no_reads", action="store_true",
+                        help="don't print the per-read results")
+    parser.add_argument("--block_lines", type=int, default=100000,
+                        help="lines to evaluate at a time")
+    args = args[1:]
+    return parser.parse_args(args)
+
+class ConfusionTable(object):
+    """ correct, incorrect and failed read counts per threshold and MAPQ bin """
+    def __init__(self, thresholds, bin_width):
+        self.thresholds = thresholds
+        self.bin_width = bin_width
+        self.correct = np.zeros((len(thresholds), 0), dtype=np.int64)
+        self.aligned = np.zeros(0, dtype=np.int64)
+        self.failed = 0
+
+    def add(self, mapq, correct, failed):
+        """ add a block of aligned reads' MAPQs, their thresholds x reads
+        correctness matrix, and the number of reads that failed to align """
+        bins = mapq // self.bin_width
+        n_bins = max(len(self.aligned), int(bins.max()) + 1 if len(bins) else 0)
+        self._grow(n_bins)
+        self.aligned += np.bincount(bins, minlength=n_bins)
+        for i in xrange(len(self.thresholds)):
+            self.correct[i] += np.bincount(bins, weights=correct[i], minlength=n_bins).astype(np.int64)
+        self.failed += failed
+
+    def _grow(self, n_bins):
+        extra = n_bins - len(self.aligned)
+        if extra > 0:
+            self.aligned = np.concatenate([self.aligned, np.zeros(extra, dtype=np.int64)])
+            self.correct = np.hstack([self.correct, np.zeros((len(self.thresholds), extra),
+                                                             dtype=np.int64)])
+
+    def write(self, out):
+        """ write the table as TSV. failed reads go in bin 0, as they get MAPQ 0 """
+        self._grow(1)
+        failed = np.zeros(len(self.aligned), dtype=np.int64)
+        failed[0] = self.failed
+        out.write("threshold\tmapq\treads\tcorrect\tincorrect\tfailed\t"
+                  "correct.at.or.above\tincorrect.at.or.above\n")
+        for i, threshold in enumerate(self.thresholds):
+            correct = self.correct[i]
+            incorrect = self.aligned - correct
+            # from the highest MAPQ down
+            correct_above = np.cumsum(correct[::-1])[::-1]
+            incorrect_above = np.cumsum((incorrect + failed)[::-1])[::-1]
+            for b in reversed(xrange(len(self.aligned))):
+                reads = self.aligned[b] + failed[b]
+                if reads == 0:
+                    continue
+                out.write("{}\t{}\t{}\t{}\t{}\t{}\t{}\t{}\n".format(
+                    threshold, b * self.bin_width, reads, correct[b], incorrect[b], failed[b],
+                    correct_above[b], incorrect_above[b]))
 
-threshold = int(sys.argv[1])
+def int_or_zero(token):
+    try:
+        return int(token)
+    except ValueError:
+        return 0
 
-for line in sys.stdin:
-    fields = line.split(' ')
+def evaluate_block(lines, thresholds):
+    """
+    Evaluate a block of comparison lines. Returns the rows split into fields,
+    a mask of the rows that aligned, their MAPQs and scores, and the thresholds
+    x aligned rows matrix of correctness
+    """
+    rows = [line.rstrip("\n").split(" ") for line in lines]
     # every input has a true position, and if it has less than the expected number of fields we assume alignment failed
-    aln_name = fields[0]
-    if len(fields) != 13:
-        print aln_name, 0, 0, 0, 0, 0, 0, 0, 0, 0
-        continue
-    aln_chr = fields[1]
-    aln_pos = int(fields[2])
-    aln_mapq = int(fields[3])
-    aln_score = 0
-    try: aln_score = int(fields[4])
-    except: pass
-    true_chr = fields[5]
-    true_pos = int(fields[6])
-    length = int(fields[7])
-    unaligned = int(fields[8])
-    known_nodes = int(fields[9])
-    known_bp = int(fields[10])
-    novel_nodes = int(fields[11])
-    novel_bp = int(fields[12])
-    aln_correct = 1 if aln_chr == true_chr and abs(true_pos - aln_pos) < threshold else 0
-    print aln_name, aln_correct, aln_mapq, aln_score, length, unaligned, known_nodes, known_bp, novel_nodes, novel_bp
+    aligned = np.array([len(fields) == 13 for fields in rows], dtype=bool)
+    good = [fields for fields in rows if len(fields) == 13]
+    if len(good) == 0:
+        return rows, aligned, np.zeros(0, dtype=np.int64), [], np.zeros((len(thresholds), 0), dtype=bool)
+    table = np.array(good)
+    same_chr = table[:, 1] == table[:, 5]
+    distance = np.abs(table[:, 6].astype(np.int64) - table[:, 2].astype(np.int64))
+    mapq = table[:, 3].astype(np.int64)
+    scores = [int_or_zero(fields[4]) for fields in good]
+    correct = same_chr & (distance < np.array(thresholds, dtype=np.int64)[:, None])
+    return rows, aligned, mapq, scores, correct
+
+def write_reads(out, rows, aligned, scores, correct, n_thresholds):
+    """ print the per-read results, one correct column per threshold """
+    lines = []
+    failed_tail = " 0" * (8 + n_thresholds)
+    correct_strs = np.where(correct, "1", "0").T.tolist()
+    j = 0
+    for fields, ok in itertools.izip(rows, aligned.tolist()):
+        if not ok:
+            lines.append(fields[0] + failed_tail + "\n")
+            continue
+        lines.append(" ".join([fields[0]] + correct_strs[j] + [fields[3], str(scores[j])] +
+                              fields[7:13]) + "\n")
+        j += 1
+    out.writelines(lines)
+
+def main(args):
+    options = parse_args(args)
+    thresholds = options.thresholds
+    table = ConfusionTable(thresholds, options.bin_width)
+
+    while True:
+        lines = list(itertools.islice(sys.stdin, options.block_lines))
+        if len(lines) == 0:
+            break
+        rows, aligned, mapq, scores, correct = evaluate_block(lines, thresholds)
+        if not options.no_reads:
+            write_reads(sys.stdout, rows, aligned, scores, correct, len(thresholds))
+        if options.table:
+            table.add(mapq, correct, len(rows) - len(mapq))
+
+    if options.table:
+        with open(options.table, "w") as out:
+            table.write(out)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
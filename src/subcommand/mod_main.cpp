@@ -73,7 +73,7 @@ void help_mod(char** argv) {
          << "    -m, --markers           join all head and tails nodes to marker nodes" << endl
          << "                            ('###' starts and '$$$' ends) of --length, for debugging" << endl
          << "    -F, --force-path-match  sets path edits explicitly equal to the nodes they traverse" << endl
-         << "    -y, --destroy-node ID   remove node with given id" << endl
+         << "    -y, --destroy-node ID   remove node with given id, multiple allowed" << endl
          << "    -B, --bluntify          bluntify the graph, making nodes for duplicated sequences in overlaps" << endl
          << "    -a, --cactus            convert to cactus graph representation" << endl
          << "    -v, --sample-vcf FILE   for a graph with allele paths, compute the sample graph from the given VCF" << endl
@@ -123,7 +123,7 @@ int main_mod(int argc, char** argv) {
     uint32_t dagify_to = 0;
     uint32_t dagify_component_length_max = 0;
     bool orient_forward = false;
-    int64_t destroy_node_id = 0;
+    vector<int64_t> destroy_node_ids;
     bool bluntify = false;
     int until_normal_iter = 0;
     string translation_file;
@@ -360,7 +360,7 @@ int main_mod(int argc, char** argv) {
             break;
 
         case 'y':
-            destroy_node_id = atoi(optarg);
+            destroy_node_ids.push_back(atoi(optarg));
             break;
 
         case 'a':
@@ -834,7 +834,7 @@ int main_mod(int argc, char** argv) {
         graph->add_start_end_markers(path_length, '#', '$', head_node, tail_node);
     }
 
-    if (destroy_node_id > 0) {
+    for (auto destroy_node_id : destroy_node_ids) {
         graph->destroy_node(destroy_node_id);
     }
 
@@ -7,7 +7,7 @@ PATH=../bin:$PATH # for vg
 
 export LC_ALL="C" # force a consistent sort order 
 
-plan tests 41
+plan tests 42
 
 is $(vg construct -r small/x.fa -v small/x.vcf.gz | vg mod -k x - | vg view - | grep "^P" | cut -f 3 | grep -o "[0-9]\+" |  wc -l) \
     $(vg construct -r small/x.fa -v small/x.vcf.gz | vg mod -k x - | vg view - | grep "^S" | wc -l) \
@@ -15,6 +15,10 @@ is $(vg construct -r small/x.fa -v small/x.vcf.gz | vg mod -k x - | vg view - |
 
 is $(vg mod -o graphs/orphans.vg | vg view - | wc -l) 8 "orphan edge removal works"
 
+is $(vg construct -r small/x.fa -v small/x.vcf.gz | vg mod -y 1 -y 2 -y 3 - | vg mod -o - | vg stats -N -) \
+    $(( $(vg construct -r small/x.fa -v small/x.vcf.gz | vg stats -N -) - 3 )) \
+    "multiple nodes can be destroyed at once"
+
 vg construct -r tiny/tiny.fa >t.vg
 vg index -k 11 -g t.idx.gcsa -x t.idx.xg t.vg
 